@@ -4,248 +4,304 @@ from tqdm import tqdm
 import collections as col
 import json
 import random
-import nltk
+import copy
+import functools
+import numpy as np
+from sentences import read_sentence_starts, sentence_ids, single_sent
+from parallel import imap_files
+from relation_store import token_inds
+
+
+# Value range of each histogram. Each integer value has its own bin,
+# values outside the range are counted in the first or last bin.
+HIST_RANGES = {
+    # number of words in an argument
+    "arg1_len": (0, 100),
+    "arg2_len": (0, 100),
+    # first word of the connective relative to the first word of Arg2
+    "conn_pos": (-20, 20),
+    # sentence of the first word of Arg2 relative to that of Arg1
+    "sent_dist": (-10, 10),
+}
+
+
+def new_stats():
+    """
+    Create empty statistics for a set of documents.
+
+    Return
+    ------
+    stats : dict
+        Counters of the analysis, all starting at zero,
+        a Counter of the senses and, under "hists", for each measure
+        in HIST_RANGES histograms per type and per sense.
+        The histograms are keyed by ("type", type) or ("sense", sense).
+    """
 
+    stats = {
+        "num_texts": 0,
+        "num_words": 0,
+        "num_relations": 0,
+        "num_explicit": 0,
+        "num_implicit": 0,
+        "num_other_types": 0,
+        "conn_in_arg": 0,
+        "doc_empt_arg": 0,
+        "rel_empt_arg": 0,
+        "rels_doc_with_empt": 0,
+        "len_arg1": 0,
+        "len_arg2": 0,
+        "num_between": 0,
+        "non_between": 0,
+        "non_between_explicit": 0,
+        "senses": col.Counter(),
+        "hists": dict((measure, dict()) for measure in HIST_RANGES),
+    }
+    return stats
+
+
+def merge_stats(stats, other):
+    """
+    Add the statistics of other documents to stats.
+    Statistics computed for single files or shards of a corpus
+    can be combined this way in any order.
+
+    Parameters
+    ----------
+    stats : dict
+        Statistics as returned by new_stats. Changed in place.
+    other : dict
+        Statistics to add.
+
+    Return
+    ------
+    stats : dict
+        The combined statistics.
+    """
+
+    for key, value in other.items():
+        if key not in stats:
+            stats[key] = copy.deepcopy(value)
+        elif isinstance(value, dict) and not isinstance(value, col.Counter):
+            merge_stats(stats[key], value)
+        else:
+            stats[key] += value
+    return stats
 
 
-def _single_sent(i_inds, e_inds, sent_inds):
+def _hist_add(stats, measure, groups, value):
     """
-    Return true, if each argument of the relation
-    is contained in one sentence each.
-    Also count as true, if the last word of the argument is
-    in the next sentence.
+    Count a value in the histograms of a measure for several groups.
     """
-    for j, curr_sent in enumerate(sent_inds):
-        comb = [i for i in i_inds if i in curr_sent]
-        overhang = [i for i in i_inds if i not in curr_sent]
-        if len(comb) > 0 and len(overhang) < 2:
-            if j < len(sent_inds) - 1:
-                next_sent = sent_inds[j+1]
-                comb2 = [i for i in e_inds if i in next_sent]
-                overhang2 = [i for i in e_inds if i not in next_sent]
-                if len(comb2) > 0 and len(overhang) < 2:
-                    return True
-            if j > 0:
-                prev_sent = sent_inds[j-1]
-                comb2 = [i for i in e_inds if i in prev_sent]
-                overhang2 = [i for i in e_inds if i not in prev_sent]
-                if len(comb2) > 0 and len(overhang) < 2:
-                    return True
-    return False
+    low, high = HIST_RANGES[measure]
+    hist_bin = min(max(value, low), high) - low
+    hists = stats["hists"][measure]
+    for group in groups:
+        if group not in hists:
+            hists[group] = np.zeros(high - low + 1, dtype=np.int64)
+        hists[group][hist_bin] += 1
 
 
-def analyze_dir(to_analyze, txt_dir, res_path, on_pcc=False):
+def _hist_quantile(hist, low, q):
     """
-    Analyze dataset in one directory.
+    Find the value below which a fraction q of the counted values lie.
+    """
+    cum = np.cumsum(hist)
+    return low + int(np.searchsorted(cum, q * cum[-1]))
+
+
+def _base_sense(sense):
+    """
+    Remove the argument level from senses like Contingency.Cause.Arg1-as-cause.
+    """
+    sense_levels = sense.split(".")
+    if len(sense_levels) > 2 and sense_levels[2].startswith("Arg"):
+        sense = sense_levels[0] + "." + sense_levels[1]
+    return sense
+
+
+def file_stats(fn, to_analyze, txt_dir, on_pcc=False, cache_dir=None):
+    """
+    Compute the statistics for one file of relations.
 
     Parameters
     ----------
+    fn : str
+        Name of the relations file.
     to_analyze : str
-        Path to directory for which to do the analysis.
+        Path to directory containing the file.
     txt_dir : str
         Path to directory containing text files.
-    res_path : str
-        Path to write results to.
     on_pcc : bool
         Whether the underlying text is from the PCC.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in.
+
+    Return
+    ------
+    stats : dict
+        Statistics of the file, see new_stats.
     """
 
-    sense_counts = dict()
-    num_relations = 0
-    num_texts = 0
-    num_explicit = 0
-    num_implicit = 0
-    num_other_types = 0
-    conn_in_arg = 0
-    num_words = 0
-    doc_empt_arg = 0
-    rel_empt_arg = 0
-    rels_doc_with_empt = 0
-    len_arg1, len_arg2 = 0, 0
-    num_between = 0
-    non_between = 0
-    non_between_explicit = 0
-
-    for fn in tqdm(os.listdir(to_analyze)):
-        txt_path = os.path.join(txt_dir, fn.split(".")[0] + ".txt")
-        with open(txt_path) as txt_file:
-            lines = txt_file.readlines()
-            if on_pcc:
-                sents = []
-                for line in lines:
-                    curr_sents = nltk.sent_tokenize(line)
-                    curr_sents = [s.split() for s in curr_sents]
-                    sents += curr_sents
-            else:
-                sents = [line.split() for line in lines]
-            sent_inds = []
-            word_count = 0
-            for sent in sents:
-                inds = set([i + word_count for i in range(len(sent))])
-                sent_inds.append(inds)
-                word_count += len(sent)
-
-        num_texts += 1
-        num_words += word_count
-
-        empt_in_doc = False
-        json_path = os.path.join(to_analyze, fn)
-        with open(json_path) as json_file:
-            lines = json_file.readlines()
-        for line in lines:
+    stats = new_stats()
+    txt_path = os.path.join(txt_dir, fn.split(".")[0] + ".txt")
+    starts = read_sentence_starts(txt_path, split_lines=on_pcc,
+                                  cache_dir=cache_dir)
+
+    stats["num_texts"] += 1
+    stats["num_words"] += int(starts[-1])
+
+    empt_in_doc = False
+    num_rels = 0
+    json_path = os.path.join(to_analyze, fn)
+    with open(json_path) as json_file:
+        for line in json_file:
             relation = json.loads(line)
-            num_relations += 1
-
-            sense = relation["Sense"][0]
-            sense_levels = sense.split(".")
-            if len(sense_levels) > 2 and sense_levels[2].startswith("Arg"):
-                sense = sense_levels[0] + "." + sense_levels[1]
-            if sense in sense_counts:
-                sense_counts[sense] += 1
-            else:
-                sense_counts[sense] = 1
-
-            c_inds = relation["Connective"]["TokenList"]
-            if len(c_inds) > 0 and isinstance(c_inds[0], list):
-                # this is the case when we use the output of the GermanShallowDiscourseParser
-                c_inds = [l[2] for l in c_inds]
-            c_inds = set(c_inds)
-            i_inds = relation["Arg1"]["TokenList"]
-            if len(i_inds) > 0 and isinstance(i_inds[0], list):
-                i_inds = [l[2] for l in i_inds]
-            i_inds = set(i_inds)
-            e_inds = relation["Arg2"]["TokenList"]
-            if len(e_inds) > 0 and isinstance(e_inds[0], list):
-                e_inds = [l[2] for l in e_inds]
-            e_inds = set(e_inds)
+            num_rels += 1
+
+            sense = _base_sense(relation["Sense"][0])
+            stats["senses"][sense] += 1
+
+            c_inds = set(token_inds(relation["Connective"]["TokenList"]))
+            i_inds = set(token_inds(relation["Arg1"]["TokenList"]))
+            e_inds = set(token_inds(relation["Arg2"]["TokenList"]))
+
+            groups = [("type", relation["Type"]), ("sense", sense)]
+            _hist_add(stats, "arg1_len", groups, len(i_inds))
+            _hist_add(stats, "arg2_len", groups, len(e_inds))
+            if len(c_inds) > 0 and len(e_inds) > 0:
+                _hist_add(stats, "conn_pos", groups, min(c_inds) - min(e_inds))
+            if len(i_inds) > 0 and len(e_inds) > 0:
+                sent1, sent2 = sentence_ids(starts, [min(i_inds), min(e_inds)]).tolist()
+                if sent1 >= 0 and sent2 >= 0:
+                    _hist_add(stats, "sent_dist", groups, sent2 - sent1)
 
             if len(e_inds) == 0 or len(i_inds) == 0:
-                rel_empt_arg += 1
+                stats["rel_empt_arg"] += 1
                 empt_in_doc = True
 
-            def set_add(s1, s2):
-                for el in s2:
-                    s1.add(el)
-                return s1
-
             if relation["Type"] == "Implicit":
-                num_implicit += 1
-                if _single_sent(i_inds, e_inds, sent_inds):
-                    num_between += 1
+                stats["num_implicit"] += 1
+                if single_sent(i_inds, e_inds, starts):
+                    stats["num_between"] += 1
                 else:
-                    non_between += 1
-                    if "orig_type" in relation.keys() and relation["orig_type"] == "Explicit":
-                        non_between_explicit += 1
+                    stats["non_between"] += 1
+                    if relation.get("orig_type") == "Explicit":
+                        stats["non_between_explicit"] += 1
             elif relation["Type"] == "Explicit":
-                len_arg1 += len(i_inds)
-                len_arg2 += len(e_inds)
-                num_explicit += 1
-                arg_inds = set_add(i_inds, e_inds)
-                if c_inds.issubset(arg_inds):
-                    conn_in_arg += 1
+                stats["len_arg1"] += len(i_inds)
+                stats["len_arg2"] += len(e_inds)
+                stats["num_explicit"] += 1
+                if c_inds.issubset(i_inds | e_inds):
+                    stats["conn_in_arg"] += 1
             else:
-                num_other_types += 1
+                stats["num_other_types"] += 1
 
-        if empt_in_doc:
-            rels_doc_with_empt += len(lines)
-            doc_empt_arg += 1
+    stats["num_relations"] += num_rels
+    if empt_in_doc:
+        stats["rels_doc_with_empt"] += num_rels
+        stats["doc_empt_arg"] += 1
 
-    with open(res_path, "w") as res_file:
-        res_file.write("analyzed directory: " + to_analyze + "\n")
-        res_file.write("number of documents: " + str(num_texts) + "\n")
-        res_file.write("number of words: " + str(num_words) + "\n")
-        res_file.write("number of relations: "+ str(num_relations) + "\n")
-        if num_texts > 0:
-            frac_docs = float(num_relations) / float(num_texts)
-            res_file.write("relations per document: " + str(frac_docs) + "\n")
-            frac_words = float(num_words) / float(num_texts)
-            res_file.write("words per document: " + str(frac_words) + "\n")
-        else:
-            res_file.write("relations per document: \n")
-            res_file.write("words per document: \n")
-        if num_words > 0:
-            frac_words = float(num_relations) / float(num_words)
-            res_file.write("relations per word: " + str(frac_words) + "\n")
-            frac_arg1 = float(len_arg1) / float(num_words)
-            res_file.write("frac of words in arg1: " + str(frac_arg1) + "\n")
-            frac_arg2 = float(len_arg2) / float(num_words)
-            res_file.write("frac of words in arg2: " + str(frac_arg2) + "\n")
-        else:
-            res_file.write("relations per word: \n")
-            res_file.write("frac of words in arg1: \n")
-            res_file.write("frac of words in arg2: \n")
+    return stats
 
-        res_file.write("\n#### Senses ####\n")
-        for sense in sorted(sense_counts.keys()):
-            if num_relations > 0:
-                frac = float(sense_counts[sense]) / float(num_relations)
-                res_file.write(sense + ": " + str(frac) + "\n")
-            else:
-                res_file.write(sense + ": \n")
-        res_file.write("\n")
-        res_file.write("num implicit: " + str(num_implicit) + "\n")
-        res_file.write("num explicit: " + str(num_explicit) + "\n")
-        if num_relations > 0:
-            frac_impl = float(num_implicit) / float(num_relations)
-            res_file.write("fraction implicit: " + str(frac_impl) + "\n")
-            frac_expl = float(num_explicit) / float(num_relations)
-            res_file.write("fraction explicit: " + str(frac_expl) + "\n")
-        else:
-            res_file.write("fraction implicit: \n")
-            res_file.write("fraction explicit: \n")
 
-        impl_per_doc = float(num_implicit) / float(num_texts)
-        res_file.write("implicit per document: " + str(impl_per_doc) + "\n")
-        impl_per_words = float(num_implicit) / float(num_words)
-        res_file.write("implicit per word: " + str(impl_per_words) + "\n")
-        expl_per_doc = float(num_explicit) / float(num_texts)
-        res_file.write("explicit per document: " + str(expl_per_doc) + "\n")
-        expl_per_words = float(num_explicit) / float(num_words)
-        res_file.write("explicit per word: " + str(expl_per_words) + "\n")
+def file_stats_pcc(fn, to_analyze, txt_dir, cache_dir=None):
+    """
+    Compute the statistics for one PCC xml file.
 
-        res_file.write("\n#### Arguments ####\n")
-        if num_implicit > 0:
-            frac_between = float(num_between) / float(num_implicit)
-            res_file.write("Fraction of implicit relations between two sentences: " + str(frac_between) + "\n")
-            frac_non_between = float(non_between) / float(num_implicit)
-            res_file.write("Fraction of implicit relations not between two sentences: " + str(frac_between) + "\n")
+    Parameters
+    ----------
+    fn : str
+        Name of the xml file.
+    to_analyze : str
+        Path to directory containing the file.
+    txt_dir : str
+        Path to directory containing tokenized text files.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in.
+
+    Return
+    ------
+    stats : dict
+        Statistics of the file, see new_stats.
+    """
+
+    stats = new_stats()
+    txt_path = os.path.join(txt_dir, fn.split(".")[0] + ".tok")
+    starts = read_sentence_starts(txt_path, cache_dir=cache_dir)
+
+    stats["num_texts"] += 1
+    stats["num_words"] += int(starts[-1])
+
+    xml_path = os.path.join(to_analyze, fn)
+    tree = etree.parse(xml_path)
+    relations = tree.findall(".//relation")
+    empt_in_doc = False
+    for relation in relations:
+        stats["num_relations"] += 1
+
+        if "pdtb3_sense" in relation.attrib:
+            sense = relation.attrib["pdtb3_sense"]
+        elif relation.attrib["type"] == "EntRel":
+            sense = "EntRel"
         else:
-            res_file.write("Fraction of implicit relations between two sentences: \n")
-            res_file.write("Fraction of implicit relations not between two sentences: \n")
-        if non_between > 0:
-            frac_from_ex = float(non_between_explicit) / float(non_between)
-            res_file.write("Fraction of relations not between two sents that were originally explicit: " + str(frac_from_ex) + "\n")
+            sense = "None"
+        stats["senses"][_base_sense(sense)] += 1
+
+        if relation.attrib["type"] == "explicit":
+            ct = relation.find("connective_tokens")
+            c_inds = set([t.attrib["id"] for t in ct])
         else:
-            res_file.write("Fraction of relations not between two sents that were originally explicit: \n")
-        
-        if num_explicit > 0:
-            frac_conn_in_arg = float(conn_in_arg) / float(num_explicit)
-            res_file.write("\nFraction of explicit where the connective")
-            res_file.write(" is also part of one or both arguments: ")
-            res_file.write(str(frac_conn_in_arg) + "\n")
+            c_inds = set()
+        it = relation.find("int_arg_tokens")
+        i_inds = set([t.attrib["id"] for t in it])
+        et = relation.find("ext_arg_tokens")
+        e_inds = set([t.attrib["id"] for t in et])
+
+        if len(e_inds) == 0 or len(i_inds) == 0:
+            stats["rel_empt_arg"] += 1
+            empt_in_doc = True
+
+        if relation.attrib["type"] == "implicit" or relation.attrib["type"] == "EntRel":
+            stats["num_implicit"] += 1
+            # token ids in the xml files are strings
+            i_nums = [int(i) for i in i_inds]
+            e_nums = [int(i) for i in e_inds]
+            if single_sent(i_nums, e_nums, starts):
+                stats["num_between"] += 1
+        elif relation.attrib["type"] == "explicit":
+            stats["len_arg1"] += len(i_inds)
+            stats["len_arg2"] += len(e_inds)
+            stats["num_explicit"] += 1
+            if c_inds.issubset(i_inds | e_inds):
+                stats["conn_in_arg"] += 1
         else:
-            res_file.write("\nFraction of explicit where the connective")
-            res_file.write(" is also part of one or both arguments: \n")
+            stats["num_other_types"] += 1
 
-        res_file.write("\n#####Relations with empty arguments####\n")
-        res_file.write("number: " + str(rel_empt_arg) + "\n")
-        frac_of_rels = str(float(rel_empt_arg) / float(num_relations))
-        res_file.write("fraction: " + frac_of_rels  + "\n")
-        res_file.write("#docs with empty args: " + str(doc_empt_arg) + "\n")
-        frac_of_docs = str(float(doc_empt_arg) / float(num_texts))
-        res_file.write("fraction: " + frac_of_docs  + "\n")
-        if rels_doc_with_empt > 0:
-            frac_empt_in_empt_docs = str(float(rel_empt_arg) /
-                                         float(rels_doc_with_empt))
-        else:
-            frac_empt_in_empt_docs = ""
-        res_file.write("fraction of empty among rels in docs with empty: " + 
-                frac_empt_in_empt_docs + "\n")
+    if empt_in_doc:
+        # counts lines of the text file, as the analysis always did
+        stats["rels_doc_with_empt"] += len(starts) - 1
+        stats["doc_empt_arg"] += 1
 
+    return stats
 
-def analyze_dir_pcc(to_analyze, txt_dir, res_path):
+
+def _collect_stats(func, fns, workers):
     """
-    Analyze dataset in one directory, but work on PCC xml files.
+    Compute statistics for each file, sequentially or in worker processes,
+    and merge them.
+    """
+    stats = new_stats()
+    for file_res in imap_files(func, fns, workers):
+        merge_stats(stats, file_res)
+    return stats
+
+
+def dir_stats(to_analyze, txt_dir, on_pcc=False, workers=1, cache_dir=None):
+    """
+    Compute the statistics for a directory of relations.
+    The results of several directories, e.g. shards of a corpus,
+    can be combined with merge_stats.
 
     Parameters
     ----------
@@ -253,102 +309,74 @@ def analyze_dir_pcc(to_analyze, txt_dir, res_path):
         Path to directory for which to do the analysis.
     txt_dir : str
         Path to directory containing text files.
-    res_path : str
-        Path to write results to.
+    on_pcc : bool
+        Whether the underlying text is from the PCC.
+    workers : int
+        Number of processes to analyze files in.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in.
+
+    Return
+    ------
+    stats : dict
+        Statistics of the directory, see new_stats.
     """
 
-    sense_counts = dict()
-    num_relations = 0
-    num_texts = 0
-    num_explicit = 0
-    num_implicit = 0
-    num_other_types = 0
-    conn_in_arg = 0
-    num_words = 0
-    doc_empt_arg = 0
-    rel_empt_arg = 0
-    rels_doc_with_empt = 0
-    len_arg1, len_arg2 = 0, 0
-    num_between = 0
-
-    for fn in tqdm(os.listdir(to_analyze)):
-        txt_path = os.path.join(txt_dir, fn.split(".")[0] + ".tok")
-        with open(txt_path) as txt_file:
-            lines = txt_file.readlines()
-            sents = [line.split() for line in lines]
-            sent_inds = []
-            word_count = 0
-            for sent in sents:
-                inds = set([i + word_count for i in range(len(sent))])
-                sent_inds.append(inds)
-                word_count += len(sent)
-
-        num_texts += 1
-        num_words += word_count
-
-        xml_path = os.path.join(to_analyze, fn)
-        tree = etree.parse(xml_path)
-        relations = tree.findall(".//relation")
-        empt_in_doc = False
-        for relation in relations:
-            num_relations += 1
-
-            if "pdtb3_sense" in relation.attrib:
-                sense = relation.attrib["pdtb3_sense"]
-            elif relation.attrib["type"] == "EntRel":
-                sense = "EntRel"
-            else:
-                sense = "None"
-            sense_levels = sense.split(".")
-            if len(sense_levels) > 2 and sense_levels[2].startswith("Arg"):
-                sense = sense_levels[0] + "." + sense_levels[1]
-            if sense in sense_counts:
-                sense_counts[sense] += 1
-            else:
-                sense_counts[sense] = 1
+    stats_fn = functools.partial(file_stats, to_analyze=to_analyze,
+                                 txt_dir=txt_dir, on_pcc=on_pcc,
+                                 cache_dir=cache_dir)
+    return _collect_stats(stats_fn, os.listdir(to_analyze), workers)
 
-            if relation.attrib["type"] == "explicit":
-                ct = relation.find("connective_tokens")
-                c_inds = set([t.attrib["id"] for t in ct])
-            else:
-                c_inds = set()
-            it = relation.find("int_arg_tokens")
-            i_inds = set([t.attrib["id"] for t in it])
-            et = relation.find("ext_arg_tokens")
-            e_inds = set([t.attrib["id"] for t in et])
 
-            if len(e_inds) == 0 or len(i_inds) == 0:
-                rel_empt_arg += 1
-                empt_in_doc = True
+def dir_stats_pcc(to_analyze, txt_dir, workers=1, cache_dir=None):
+    """
+    Compute the statistics for a directory of PCC xml files.
 
-            def set_add(s1, s2):
-                for el in s2:
-                    s1.add(el)
-                return s1
+    Parameters
+    ----------
+    to_analyze : str
+        Path to directory for which to do the analysis.
+    txt_dir : str
+        Path to directory containing tokenized text files.
+    workers : int
+        Number of processes to analyze files in.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in.
+
+    Return
+    ------
+    stats : dict
+        Statistics of the directory, see new_stats.
+    """
+
+    stats_fn = functools.partial(file_stats_pcc, to_analyze=to_analyze,
+                                 txt_dir=txt_dir, cache_dir=cache_dir)
+    return _collect_stats(stats_fn, os.listdir(to_analyze), workers)
 
-            if relation.attrib["type"] == "implicit" or relation.attrib["type"] == "EntRel":
-                num_implicit += 1
-                if _single_sent(i_inds, e_inds, sent_inds):
-                    num_between += 1
-                else:
-                    # one of the arguments could still be a sentence
-                    if i_inds in sent_inds or set_add(i_inds, c_inds) in sent_inds:
-                        one_sent += 1
-                    elif e_inds in sent_inds or set_add(e_inds, c_inds) in sent_inds:
-                        one_sent += 1
-            elif relation.attrib["type"] == "explicit":
-                len_arg1 += len(i_inds)
-                len_arg2 += len(e_inds)
-                num_explicit += 1
-                arg_inds = set_add(i_inds, e_inds)
-                if c_inds.issubset(arg_inds):
-                    conn_in_arg += 1
-            else:
-                num_other_types += 1
 
-        if empt_in_doc:
-            rels_doc_with_empt += len(lines)
-            doc_empt_arg += 1
+def write_stats(stats, to_analyze, res_path, non_between=True):
+    """
+    Write the report for the statistics of a dataset.
+
+    Parameters
+    ----------
+    stats : dict
+        Statistics as returned by dir_stats or merge_stats.
+    to_analyze : str
+        Name of the analyzed directory, to write in the report.
+    res_path : str
+        Path to write results to.
+    non_between : bool
+        Whether to report on implicit relations not between two sentences.
+        The PCC analysis doesn't count them.
+    """
+
+    num_texts = stats["num_texts"]
+    num_words = stats["num_words"]
+    num_relations = stats["num_relations"]
+    num_explicit = stats["num_explicit"]
+    num_implicit = stats["num_implicit"]
+    sense_counts = stats["senses"]
 
     with open(res_path, "w") as res_file:
         res_file.write("analyzed directory: " + to_analyze + "\n")
@@ -366,9 +394,9 @@ def analyze_dir_pcc(to_analyze, txt_dir, res_path):
         if num_words > 0:
             frac_words = float(num_relations) / float(num_words)
             res_file.write("relations per word: " + str(frac_words) + "\n")
-            frac_arg1 = float(len_arg1) / float(num_words)
+            frac_arg1 = float(stats["len_arg1"]) / float(num_words)
             res_file.write("frac of words in arg1: " + str(frac_arg1) + "\n")
-            frac_arg2 = float(len_arg2) / float(num_words)
+            frac_arg2 = float(stats["len_arg2"]) / float(num_words)
             res_file.write("frac of words in arg2: " + str(frac_arg2) + "\n")
         else:
             res_file.write("relations per word: \n")
@@ -405,13 +433,24 @@ def analyze_dir_pcc(to_analyze, txt_dir, res_path):
 
         res_file.write("\n#### Arguments ####\n")
         if num_implicit > 0:
-            frac_between = float(num_between) / float(num_implicit)
+            frac_between = float(stats["num_between"]) / float(num_implicit)
             res_file.write("Fraction of implicit relations between two sentences: " + str(frac_between) + "\n")
+            if non_between:
+                frac_non_between = float(stats["non_between"]) / float(num_implicit)
+                res_file.write("Fraction of implicit relations not between two sentences: " + str(frac_non_between) + "\n")
         else:
             res_file.write("Fraction of implicit relations between two sentences: \n")
+            if non_between:
+                res_file.write("Fraction of implicit relations not between two sentences: \n")
+        if non_between:
+            if stats["non_between"] > 0:
+                frac_from_ex = float(stats["non_between_explicit"]) / float(stats["non_between"])
+                res_file.write("Fraction of relations not between two sents that were originally explicit: " + str(frac_from_ex) + "\n")
+            else:
+                res_file.write("Fraction of relations not between two sents that were originally explicit: \n")
         
         if num_explicit > 0:
-            frac_conn_in_arg = float(conn_in_arg) / float(num_explicit)
+            frac_conn_in_arg = float(stats["conn_in_arg"]) / float(num_explicit)
             res_file.write("\nFraction of explicit where the connective")
             res_file.write(" is also part of one or both arguments: ")
             res_file.write(str(frac_conn_in_arg) + "\n")
@@ -419,6 +458,8 @@ def analyze_dir_pcc(to_analyze, txt_dir, res_path):
             res_file.write("\nFraction of explicit where the connective")
             res_file.write(" is also part of one or both arguments: \n")
 
+        rel_empt_arg = stats["rel_empt_arg"]
+        doc_empt_arg = stats["doc_empt_arg"]
         res_file.write("\n#####Relations with empty arguments####\n")
         res_file.write("number: " + str(rel_empt_arg) + "\n")
         frac_of_rels = str(float(rel_empt_arg) / float(num_relations))
@@ -426,146 +467,202 @@ def analyze_dir_pcc(to_analyze, txt_dir, res_path):
         res_file.write("#docs with empty args: " + str(doc_empt_arg) + "\n")
         frac_of_docs = str(float(doc_empt_arg) / float(num_texts))
         res_file.write("fraction: " + frac_of_docs  + "\n")
-        if rels_doc_with_empt > 0:
+        if stats["rels_doc_with_empt"] > 0:
             frac_empt_in_empt_docs = str(float(rel_empt_arg) /
-                                         float(rels_doc_with_empt))
+                                         float(stats["rels_doc_with_empt"]))
         else:
             frac_empt_in_empt_docs = ""
         res_file.write("fraction of empty among rels in docs with empty: " + 
                 frac_empt_in_empt_docs + "\n")
 
 
+def write_histograms(stats, hist_path):
+    """
+    Write the histograms of a dataset as tab-separated tables,
+    one per measure, with one row per type and sense.
+
+    Parameters
+    ----------
+    stats : dict
+        Statistics as returned by dir_stats or merge_stats.
+    hist_path : str
+        Path to write histograms to.
+    """
+
+    with open(hist_path, "w") as hist_file:
+        for measure, (low, high) in HIST_RANGES.items():
+            labels = [str(v) for v in range(low, high + 1)]
+            if low < 0:
+                labels[0] = "<=" + labels[0]
+            labels[-1] = ">=" + labels[-1]
+            hist_file.write("#### " + measure + " ####\n")
+            hist_file.write("group\tcount\tmedian\tp90\t" + "\t".join(labels) + "\n")
+            hists = stats["hists"][measure]
+            for group in sorted(hists.keys()):
+                hist = hists[group]
+                row = [group[0] + ":" + group[1], str(int(hist.sum())),
+                       str(_hist_quantile(hist, low, 0.5)),
+                       str(_hist_quantile(hist, low, 0.9))]
+                row += [str(c) for c in hist.tolist()]
+                hist_file.write("\t".join(row) + "\n")
+            hist_file.write("\n")
+
+
+def analyze_dir(to_analyze, txt_dir, res_path, on_pcc=False, workers=1,
+                cache_dir=None, hist_path=None):
+    """
+    Analyze dataset in one directory.
+
+    Parameters
+    ----------
+    to_analyze : str
+        Path to directory for which to do the analysis.
+    txt_dir : str
+        Path to directory containing text files.
+    res_path : str
+        Path to write results to.
+    on_pcc : bool
+        Whether the underlying text is from the PCC.
+    workers : int
+        Number of processes to analyze files in.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in,
+        so that texts are only split into sentences once.
+    hist_path : str or None
+        Path to write histograms of argument lengths, connective positions
+        and sentence distances to, see write_histograms.
+    """
+
+    stats = dir_stats(to_analyze, txt_dir, on_pcc=on_pcc, workers=workers,
+                      cache_dir=cache_dir)
+    write_stats(stats, to_analyze, res_path)
+    if hist_path is not None:
+        write_histograms(stats, hist_path)
+
+
+def analyze_dir_pcc(to_analyze, txt_dir, res_path, workers=1,
+                    cache_dir=None):
+    """
+    Analyze dataset in one directory, but work on PCC xml files.
+
+    Parameters
+    ----------
+    to_analyze : str
+        Path to directory for which to do the analysis.
+    txt_dir : str
+        Path to directory containing text files.
+    res_path : str
+        Path to write results to.
+    workers : int
+        Number of processes to analyze files in.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in.
+    """
+
+    stats = dir_stats_pcc(to_analyze, txt_dir, workers=workers,
+                          cache_dir=cache_dir)
+    write_stats(stats, to_analyze, res_path, non_between=False)
+
+
 #analyze_dir_pcc("/data/PotsdamCommentaryCorpus/connectives",
 #                "/data/PotsdamCommentaryCorpus/tokenized",
 #                "/data/europarl/common/analysis/corpora/pcc_again.txt")
 
 
-def analyze_transfer(orig_dir, trans_dir, out_path):
+TRANSFER_KINDS = ["e2e", "e2i", "i2i", "i2e", "losti", "loste"]
+
+
+def _transfer_file_counts(orig_path, trans_path, counts):
     """
-    Analyze differences produced by transferring to German text.
+    Count for each sense how the relations of one document were transferred.
+    Relations are joined by their document and relation ids.
+    """
+
+    trans_rels = dict()
+    with open(trans_path) as trans_file:
+        for line in trans_file:
+            rel = json.loads(line)
+            trans_rels[(rel.get("DocID"), rel["ID"])] = rel
+
+    with open(orig_path) as orig_file:
+        for line in orig_file:
+            ro = json.loads(line)
+            sense = ro["Sense"][0]
+            explicit = ro["Type"] == "Explicit"
+            rt = trans_rels.get((ro.get("DocID"), ro["ID"]))
+            if rt is None or (rt["orig_type"] == "Explicit") != explicit:
+                if explicit:
+                    counts["loste"][sense] += 1
+                else:
+                    counts["losti"][sense] += 1
+            elif explicit and rt["Type"] == "Explicit":
+                counts["e2e"][sense] += 1
+            elif explicit:
+                counts["e2i"][sense] += 1
+            elif ro["Type"] == rt["Type"] == "Implicit":
+                counts["i2i"][sense] += 1
+            else:
+                counts["i2e"][sense] += 1
+
+
+def transfer_counts(orig_dir, trans_dir):
+    """
+    Count how relations changed by transferring them to German text.
 
     Parameters
     ----------
     orig_dir : str
-        Path to directory containing relations 
+        Path to directory containing relations
         parsed from English or translated text.
     trans_dir : str
         Path to directory containing transferred relations.
-    out_path : str
-        Path to write results to.
-    """
 
-    orig_fns = os.listdir(orig_dir)
-    trans_fns = os.listdir(trans_dir)
-    common_fns = [fn for fn in orig_fns if fn in trans_fns]
-
-    e2e = col.defaultdict(int)
-    e2i = col.defaultdict(int)
-    i2i = col.defaultdict(int)
-    i2e = col.defaultdict(int)
-
-    losti = col.defaultdict(int)
-    loste = col.defaultdict(int)
+    Return
+    ------
+    counts : dict
+        For each of "e2e", "e2i", "i2i", "i2e", a Counter of senses
+        of relations that changed type that way,
+        and for "losti" and "loste", of implicit and explicit relations
+        that were not transferred.
+    """
 
-    for fn in tqdm(common_fns):
+    counts = dict((kind, col.Counter()) for kind in TRANSFER_KINDS)
+    common_fns = set(os.listdir(orig_dir)) & set(os.listdir(trans_dir))
+    for fn in tqdm(sorted(common_fns)):
         orig_path = os.path.join(orig_dir, fn)
-        rels_orig_ex = []
-        rels_orig_im = []
-        with open(orig_path) as orig_file:
-            for line in orig_file:
-                rel = json.loads(line)
-                if rel["Type"] == "Explicit":
-                    rels_orig_ex.append(rel)
-                else:
-                    rels_orig_im.append(rel)
-        
         trans_path = os.path.join(trans_dir, fn)
-        rels_trans_ex = dict()
-        rels_trans_im = dict()
-        with open(trans_path) as trans_file:
-            for line in trans_file:
-                rel = json.loads(line)
-                i = rel["ID"]
-                if rel["orig_type"] == "Explicit":
-                    rels_trans_ex[i] = rel
-                else:
-                    rels_trans_im[i] = rel
-
-        pairs = []
-        for rel in rels_orig_ex:
-            i = rel["ID"]
-            if not i in rels_trans_ex:
-                loste[rel["Sense"][0]] += 1
-                continue
-            rel_trans = rels_trans_ex[i]
-            pairs.append((rel, rel_trans))
-        for rel in rels_orig_im:
-            i = rel["ID"]
-            if not i in rels_trans_im:
-                losti[rel["Sense"][0]] += 1
-                continue
-            rel_trans = rels_trans_im[i]
-            pairs.append((rel, rel_trans))
-
-        for ro, rt in pairs:
-            sense = ro["Sense"][0]
-            if ro["Type"] == rt["Type"] == "Explicit":
-                e2e[sense] += 1
-            elif ro["Type"] == "Explicit":
-                e2i[sense] += 1
-            elif ro["Type"] == rt["Type"] == "Implicit":
-                i2i[sense] += 1
-            else:
-                i2e[sense] += 1
-    
-    total_all = sum(e2e.values()) + sum(e2i.values()) + sum(i2i.values()) + sum(i2e.values())
+        _transfer_file_counts(orig_path, trans_path, counts)
+    return counts
 
-    outs = "Transfer relations analysis:\n"
-    outs += "original files: " + orig_path + "\n"
-    outs += "transferred files: " + trans_path + "\n\n\n"
-    outs += "Explicit to Explicit: \n"
-    total = sum(e2e.values())
-    frac = total / total_all
-    outs += "total: {:.4f} \t {:.4f} \n".format(total, frac)
-    for sense in sorted(e2e.keys()):
-        curr_num = e2e[sense]
-        frac_e2e = curr_num / total
-        frac_all = curr_num / total_all
-        outs += sense + ":\t\t\t{0}\t{1:.4f}\t{2:.4f} \n".format(curr_num, frac_e2e, frac_all)
-    outs += "\n\n"
 
-    outs += "Explicit to Implicit: \n"
-    total = sum(e2i.values())
-    frac = total / total_all
-    outs += "total: {:.4f} \t {:.4f} \n".format(total, frac)
-    for sense in sorted(e2i.keys()):
-        curr_num = e2i[sense]
-        frac_e2i = curr_num / total
-        frac_all = curr_num / total_all
-        outs += sense + ":\t\t\t{0}\t{1:.4f}\t{2:.4f} \n".format(curr_num, frac_e2i, frac_all)
-    outs += "\n\n"
+def _transfer_report(counts, orig_dir, trans_dir):
+    """
+    Write the analysis of one transfer direction as a string.
+    """
 
-    outs += "Implicit to Implicit: \n"
-    total = sum(i2i.values())
-    frac = total / total_all
-    outs += "total: {:.4f} \t {:.4f} \n".format(total, frac)
-    for sense in sorted(i2i.keys()):
-        curr_num = i2i[sense]
-        frac_i2i = curr_num / total
-        frac_all = curr_num / total_all
-        outs += sense + ":\t\t\t{0}\t{1:.4f}\t{2:.4f} \n".format(curr_num, frac_i2i, frac_all)
-    outs += "\n\n"
+    e2e, e2i = counts["e2e"], counts["e2i"]
+    i2i, i2e = counts["i2i"], counts["i2e"]
+    losti, loste = counts["losti"], counts["loste"]
 
-    outs += "Implicit to Explicit: \n"
-    total = sum(i2e.values())
-    frac = total / total_all
-    outs += "total: {:.4f} \t {:.4f} \n".format(total, frac)
-    for sense in sorted(i2e.keys()):
-        curr_num = i2e[sense]
-        frac_i2e = curr_num / total
-        frac_all = curr_num / total_all
-        outs += sense + ":\t\t\t{0}\t{1:.4f}\t{2:.4f} \n".format(curr_num, frac_i2e, frac_all)
-    outs += "\n\n"
+    total_all = sum(e2e.values()) + sum(e2i.values()) + sum(i2i.values()) + sum(i2e.values())
+
+    outs = "Transfer relations analysis:\n"
+    outs += "original files: " + orig_dir + "\n"
+    outs += "transferred files: " + trans_dir + "\n\n\n"
+
+    sections = [("Explicit to Explicit", e2e), ("Explicit to Implicit", e2i),
+                ("Implicit to Implicit", i2i), ("Implicit to Explicit", i2e)]
+    for title, sense_counts in sections:
+        outs += title + ": \n"
+        total = sum(sense_counts.values())
+        frac = total / total_all
+        outs += "total: {:.4f} \t {:.4f} \n".format(total, frac)
+        for sense in sorted(sense_counts.keys()):
+            curr_num = sense_counts[sense]
+            frac_kind = curr_num / total
+            frac_all = curr_num / total_all
+            outs += sense + ":\t\t\t{0}\t{1:.4f}\t{2:.4f} \n".format(curr_num, frac_kind, frac_all)
+        outs += "\n\n"
 
     outs += "Implicit relations removed because an argument was empty:\n"
     outs += "total: " + str(sum(losti.values())) + "\n"
@@ -579,9 +676,9 @@ def analyze_transfer(orig_dir, trans_dir, out_path):
         outs += sense + ": " + str(loste[sense]) + "\n"
     outs += "\n\n\n"
 
-    all_senses = set(list(e2e.keys()) + list(e2i.keys()) + list(i2e.keys()) + list(i2i.keys()))
+    all_senses = set(e2e.keys()) | set(e2i.keys()) | set(i2e.keys()) | set(i2i.keys())
 
-    for sense in all_senses:
+    for sense in sorted(all_senses):
         ee = e2e[sense]
         ei = e2i[sense]
         ie = i2e[sense]
@@ -592,6 +689,80 @@ def analyze_transfer(orig_dir, trans_dir, out_path):
         outs += "i\t" + str(ie) + "\t" + str(ii) + "\t|\t" + str(round(ie/tot,3)) + "\t" + str(round(ii/tot,3)) + "\n"
         outs += "\n\n"
 
+    return outs
+
+
+def analyze_transfer(orig_dir, trans_dir, out_path):
+    """
+    Analyze differences produced by transferring to German text.
+
+    Parameters
+    ----------
+    orig_dir : str
+        Path to directory containing relations 
+        parsed from English or translated text.
+    trans_dir : str
+        Path to directory containing transferred relations.
+    out_path : str
+        Path to write results to.
+    """
+
+    counts = transfer_counts(orig_dir, trans_dir)
+    outs = _transfer_report(counts, orig_dir, trans_dir)
+
+    with open(out_path, "w") as out_file:
+        out_file.write(outs)
+
+
+def analyze_transfer_multi(dir_pairs, out_path, langs=None):
+    """
+    Analyze the transfer from several languages and write one report.
+    It starts with a summary of all languages and continues
+    with the analysis of each language, as written by analyze_transfer.
+
+    Parameters
+    ----------
+    dir_pairs : [(str, str)]
+        Pairs of directories containing the original
+        and the transferred relations of one language.
+    out_path : str
+        Path to write results to.
+    langs : [str] or None
+        Names of the languages. Defaults to the names
+        of the directories with the original relations.
+    """
+
+    if langs is None:
+        langs = [os.path.basename(os.path.normpath(orig_dir))
+                 for orig_dir, _ in dir_pairs]
+
+    lang_counts = []
+    for orig_dir, trans_dir in dir_pairs:
+        lang_counts.append(transfer_counts(orig_dir, trans_dir))
+
+    outs = "Transfer relations summary:\n"
+    outs += "language\t" + "\t".join(TRANSFER_KINDS) + "\n"
+    for lang, counts in zip(langs, lang_counts):
+        totals = [sum(counts[kind].values()) for kind in TRANSFER_KINDS]
+        outs += lang + "\t" + "\t".join(str(t) for t in totals) + "\n"
+    outs += "\n"
+    outs += "fraction of original relations:\n"
+    outs += "language\t" + "\t".join(TRANSFER_KINDS) + "\n"
+    for lang, counts in zip(langs, lang_counts):
+        totals = [sum(counts[kind].values()) for kind in TRANSFER_KINDS]
+        total_orig = sum(totals)
+        if total_orig > 0:
+            fracs = ["{:.4f}".format(t / total_orig) for t in totals]
+        else:
+            fracs = [""] * len(totals)
+        outs += lang + "\t" + "\t".join(fracs) + "\n"
+    outs += "\n\n\n"
+
+    for lang, counts, (orig_dir, trans_dir) in zip(langs, lang_counts, dir_pairs):
+        outs += "#### " + lang + " ####\n"
+        outs += _transfer_report(counts, orig_dir, trans_dir)
+        outs += "\n"
+
     with open(out_path, "w") as out_file:
         out_file.write(outs)
 
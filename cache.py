@@ -0,0 +1,56 @@
+import os
+import hashlib
+import pickle
+
+
+def hash_cached(data, cache_dir, suffix, compute, save, load):
+    """
+    Compute a result from the contents of a file.
+    With a cache directory, the result is saved there
+    under the SHA-1 of the contents, so that it is only computed once.
+
+    Parameters
+    ----------
+    data : bytes
+        Contents of the file.
+    cache_dir : str or None
+        Directory to keep results in. None to always compute them.
+    suffix : str
+        Appended to the SHA-1 to get the filename in the cache,
+        to distinguish different results for the same file.
+    compute : <function>
+        Function without arguments that computes the result.
+    save : <function>
+        Function that writes a result to an open binary file,
+        e.g. numpy.save.
+    load : <function>
+        Function that reads a result written by save from a path,
+        e.g. numpy.load. If it fails, the result is computed again.
+
+    Return
+    ------
+    result
+        Return value of compute, or the cached result.
+    """
+
+    if cache_dir is None:
+        return compute()
+
+    digest = hashlib.sha1(data).hexdigest()
+    cache_path = os.path.join(cache_dir, digest + suffix)
+    if os.path.exists(cache_path):
+        try:
+            return load(cache_path)
+        except (pickle.UnpicklingError, EOFError, OSError, ValueError):
+            # damaged or unreadable file, e.g. written by another version
+            pass
+
+    result = compute()
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    # several processes may fill the cache at the same time
+    tmp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as cache_file:
+        save(cache_file, result)
+    os.replace(tmp_path, cache_path)
+    return result
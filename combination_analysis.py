@@ -1,5 +1,6 @@
 import json
 import os
+import collections as col
 from tqdm import tqdm
 
 
@@ -188,7 +189,7 @@ def one_in_common_sense(rel1, rel2):
 def one_in_common_sense_l2(rel1, rel2):
     s1 = rel1["Sense"][0].split(".")
     s2 = rel2["Sense"][0].split(".")
-    if s1[:1] != s2[:1]:
+    if s1[:2] != s2[:2]:
         return False
     rel1_arg1 = rel1["Arg1"]["TokenList"]
     rel1_arg2 = rel1["Arg2"]["TokenList"]
@@ -221,12 +222,125 @@ def one_in_common_sense_l1(rel1, rel2):
     return False
 
 
-def unify_files(l1_path, l2_path, same_fn):
+def _overlap_score(rel1, rel2):
+    """
+    Score how well two relations overlap, as the sum of
+    the Jaccard similarities of their arguments.
+    """
+    score = 0
+    for arg in ["Arg1", "Arg2"]:
+        toks1 = set(rel1[arg]["TokenList"])
+        toks2 = set(rel2[arg]["TokenList"])
+        union = toks1 | toks2
+        if len(union) == 0:
+            score += 1
+        else:
+            score += len(toks1 & toks2) / len(union)
+    return score
+
+
+def _first_assignment(pairs):
+    """
+    Assign each relation to the first relation it is the same as,
+    that hasn't been assigned yet.
+    """
+    found1, found2 = set(), set()
+    assigned = []
+    for i, j in pairs:
+        if i in found1 or j in found2:
+            continue
+        found1.add(i)
+        found2.add(j)
+        assigned.append((i, j))
+    return assigned
+
+
+def _greedy_assignment(pairs, rels1, rels2):
+    """
+    Assign relations one-to-one, taking pairs with higher overlap first.
+    """
+    scores = dict()
+    for i, j in pairs:
+        scores[(i, j)] = _overlap_score(rels1[i], rels2[j])
+    ordered = sorted(pairs, key=lambda pair: (-scores[pair], pair))
+    return _first_assignment(ordered)
+
+
+def _max_matching(pairs):
+    """
+    Assign as many relations one-to-one as possible,
+    using the Hopcroft-Karp algorithm.
+    """
+    adj = dict()
+    for i, j in pairs:
+        adj.setdefault(i, []).append(j)
+    match1 = dict()
+    match2 = dict()
+
+    while True:
+        # breadth-first search for layers of alternating paths
+        free = [i for i in adj if i not in match1]
+        dist = dict((i, 0) for i in free)
+        queue = col.deque(free)
+        found = False
+        while queue:
+            i = queue.popleft()
+            for j in adj[i]:
+                k = match2.get(j)
+                if k is None:
+                    found = True
+                elif k not in dist:
+                    dist[k] = dist[i] + 1
+                    queue.append(k)
+        if not found:
+            break
+
+        # depth-first search for augmenting paths along the layers
+        for root in free:
+            stack = [(root, iter(adj[root]))]
+            via = []
+            while stack:
+                i, neighbours = stack[-1]
+                for j in neighbours:
+                    k = match2.get(j)
+                    if k is None:
+                        for (u, _), v in zip(stack, via + [j]):
+                            match1[u] = v
+                            match2[v] = u
+                        stack = []
+                        break
+                    if dist.get(k) == dist[i] + 1:
+                        via.append(j)
+                        stack.append((k, iter(adj[k])))
+                        break
+                else:
+                    # dead end, don't visit again in this phase
+                    dist[i] = None
+                    stack.pop()
+                    if via:
+                        via.pop()
+
+    return sorted(match1.items())
+
+
+# criteria that require each argument to overlap or be empty in both relations,
+# so that only the pairs from candidate_pairs need to be compared
+OVERLAP_CRITERIA = [unify_rels_orig, unify_rels_30, unify_rels_20, unify_rels_10,
+                    one_in_common_per_arg, one_in_common_sense,
+                    one_in_common_sense_l2, one_in_common_sense_l1]
+
+
+def unify_files(l1_path, l2_path, same_fn, assignment="first"):
     """
     For one speech, unify the relations found from two languages.
     Two relations are considered the same, if they have the same sense
     and their arguments have a 50% overlap.
 
+    For the criteria in OVERLAP_CRITERIA, only pairs of relations
+    in which each argument overlaps or is empty in both relations
+    are compared, see candidate_pairs. Other functions are called
+    for all pairs.
+
     Parameters
     ----------
     l1_path : str
@@ -237,8 +351,14 @@ def unify_files(l1_path, l2_path, same_fn):
         Path to relations for second language.
     same_fn : <function>
         Function to determine if two relations are the same.
+    assignment : str
+        How to align relations that are the same as several others.
+        "first" aligns each relation with the first one that is still free,
+        "greedy" prefers pairs with larger argument overlap,
+        "matching" aligns as many relations as possible.
+        Pairs that are the same but not aligned count as duplicates.
     """
-    
+
     rels1 = []
     rels2 = []
 
@@ -251,25 +371,32 @@ def unify_files(l1_path, l2_path, same_fn):
         rels2.append(rel)
     tot2 = len(rels2)
 
-    aligned = 0
-    found1, found2 = [], []
-    dupls = 0
+    if same_fn in OVERLAP_CRITERIA:
+        pairs = candidate_pairs(rels1, rels2)
+    else:
+        pairs = [(i, j) for i in range(tot1) for j in range(tot2)]
 
-    for i, rel1 in enumerate(rels1):
-        for j, rel2 in enumerate(rels2):
-            same = same_fn(rel1, rel2)
-            if same:
-                if rel1 in found1 or rel2 in found2:
-                    dupls += 1
-                    continue
-                found1.append(rel1)
-                found2.append(rel2)
-                aligned += 1
+    same_pairs = []
+    for i, j in pairs:
+        if same_fn(rels1[i], rels2[j]):
+            same_pairs.append((i, j))
+
+    if assignment == "first":
+        assigned = _first_assignment(same_pairs)
+    elif assignment == "greedy":
+        assigned = _greedy_assignment(same_pairs, rels1, rels2)
+    elif assignment == "matching":
+        assigned = _max_matching(same_pairs)
+    else:
+        raise ValueError("Unknown assignment: " + assignment)
+
+    aligned = len(assigned)
+    dupls = len(same_pairs) - aligned
 
     return tot1, tot2, aligned, dupls
 
 
-def unify_langs(dir1, dir2, res_path, same_fn):
+def unify_langs(dir1, dir2, res_path, same_fn, assignment="first"):
     """
     Combine relations for files in two directories.
     Instead of writing the relations to file,
@@ -285,6 +412,8 @@ def unify_langs(dir1, dir2, res_path, same_fn):
         Path to write the statistics to.
     same_fn : <function>
         Function determining if two relations are the same.
+    assignment : str
+        How to align relations, see unify_files.
     """
     fns1 = set(os.listdir(dir1))
     fns2 = set(os.listdir(dir2))
@@ -297,7 +426,8 @@ def unify_langs(dir1, dir2, res_path, same_fn):
     for fn in tqdm(fns_both):
         path1 = os.path.join(dir1, fn)
         path2 = os.path.join(dir2, fn)
-        rels1, rels2, aligned, dupl = unify_files(path1, path2, same_fn)
+        rels1, rels2, aligned, dupl = unify_files(path1, path2, same_fn,
+                                                  assignment=assignment)
         tot1 += rels1
         tot2 += rels2
         tot_aligned += aligned
@@ -306,7 +436,8 @@ def unify_langs(dir1, dir2, res_path, same_fn):
     outs = ""
     outs += dir1 + "\n"
     outs += dir2 + "\n"
-    outs += str(same_fn) + "\n\n"
+    outs += str(same_fn) + "\n"
+    outs += "assignment: " + assignment + "\n\n"
 
     frac_al1 = tot_aligned / tot1
     frac_dup1 = tot_dupl / tot1
@@ -321,3 +452,228 @@ def unify_langs(dir1, dir2, res_path, same_fn):
         res_file.write(outs)
 
 
+def candidate_pairs(rels1, rels2):
+    """
+    Find the pairs of relations that can be the same according to
+    any of the functions in this module, i.e. the pairs in which
+    each argument overlaps or is empty in both relations.
+
+    Parameters
+    ----------
+    rels1 : [dict()]
+        Relations from first language.
+    rels2 : [dict()]
+        Relations from second language.
+
+    Returns
+    -------
+    pairs : [(int, int)]
+        Positions of the relations in each pair, in the order
+        in which they are compared by unify_files.
+    """
+
+    arg_maps = []
+    for arg in ["Arg1", "Arg2"]:
+        tok_map = dict()
+        empty = set()
+        for j, rel in enumerate(rels2):
+            toks = rel[arg]["TokenList"]
+            if len(toks) == 0:
+                empty.add(j)
+            for tok in toks:
+                tok_map.setdefault(tok, set()).add(j)
+        arg_maps.append((arg, tok_map, empty))
+
+    pairs = []
+    for i, rel1 in enumerate(rels1):
+        cands = None
+        for arg, tok_map, empty in arg_maps:
+            toks = rel1[arg]["TokenList"]
+            if len(toks) == 0:
+                arg_cands = set(empty)
+            else:
+                arg_cands = set()
+                for tok in toks:
+                    arg_cands.update(tok_map.get(tok, ()))
+            cands = arg_cands if cands is None else cands & arg_cands
+        pairs += [(i, j) for j in sorted(cands)]
+    return pairs
+
+
+def pair_stats(rel1, rel2):
+    """
+    Compute the overlap and sense agreement of two relations,
+    from which all criteria in this module can be decided.
+
+    Parameters
+    ----------
+    rel1 : dict()
+        First relation.
+    rel2 : dict()
+        Second relation.
+
+    Returns
+    -------
+    stats : dict()
+        Number of words of each argument of rel1 that are also in
+        rel2 ("common1", "common2"), argument lengths ("len1_1", "len1_2",
+        "len2_1", "len2_2"), and whether the senses are the same
+        on all levels, the first two levels, or the first level
+        ("same_sense", "same_l2", "same_l1").
+    """
+
+    rel2_arg1 = set(rel2["Arg1"]["TokenList"])
+    rel2_arg2 = set(rel2["Arg2"]["TokenList"])
+    s1 = rel1["Sense"][0].split(".")
+    s2 = rel2["Sense"][0].split(".")
+
+    stats = dict()
+    stats["common1"] = len([t for t in rel1["Arg1"]["TokenList"] if t in rel2_arg1])
+    stats["common2"] = len([t for t in rel1["Arg2"]["TokenList"] if t in rel2_arg2])
+    stats["len1_1"] = len(rel1["Arg1"]["TokenList"])
+    stats["len1_2"] = len(rel1["Arg2"]["TokenList"])
+    stats["len2_1"] = len(rel2["Arg1"]["TokenList"])
+    stats["len2_2"] = len(rel2["Arg2"]["TokenList"])
+    stats["same_sense"] = rel1["Sense"] == rel2["Sense"]
+    stats["same_l2"] = s1[:2] == s2[:2]
+    stats["same_l1"] = s1[0] == s2[0]
+    return stats
+
+
+def _overlap_criterion(threshold):
+    """
+    Return a criterion on pair_stats that works like unify_rels_orig
+    (threshold 0.5) or unify_rels_30/20/10 with another threshold.
+    """
+    def criterion(st):
+        if not st["same_sense"]:
+            return False
+        if st["common1"] < st["len1_1"] * threshold or st["common1"] < st["len2_1"] * threshold:
+            return False
+        if st["common2"] < st["len1_2"] * threshold or st["common2"] < st["len2_2"] * threshold:
+            return False
+        return True
+    return criterion
+
+
+def sweep_criteria(thresholds=(0.5, 0.3, 0.2, 0.1)):
+    """
+    Return the criteria compared by sweep_langs.
+
+    Parameters
+    ----------
+    thresholds : [float]
+        Overlap thresholds for criteria like unify_rels_orig.
+        They have to be larger than 0.
+
+    Returns
+    -------
+    criteria : [(str, <function>)]
+        Name and function on pair_stats for each criterion.
+    """
+
+    criteria = []
+    for threshold in thresholds:
+        criteria.append(("overlap " + str(threshold), _overlap_criterion(threshold)))
+    one_each = lambda st: st["common1"] > 0 and st["common2"] > 0
+    criteria.append(("one_in_common_per_arg", one_each))
+    criteria.append(("one_in_common_sense",
+                     lambda st: st["same_sense"] and one_each(st)))
+    criteria.append(("one_in_common_sense_l2",
+                     lambda st: st["same_l2"] and one_each(st)))
+    criteria.append(("one_in_common_sense_l1",
+                     lambda st: st["same_l1"] and one_each(st)))
+    return criteria
+
+
+def sweep_files(l1_path, l2_path, criteria):
+    """
+    For one speech, count aligned and duplicate relations
+    for several criteria at once.
+
+    Parameters
+    ----------
+    l1_path : str
+        Path to relations file for first language.
+    l2_path : str
+        Path to relations for second language.
+    criteria : [(str, <function>)]
+        Criteria as returned by sweep_criteria.
+
+    Returns
+    -------
+    tot1, tot2 : int
+        Number of relations in each file.
+    counts : [(int, int)]
+        Number of aligned and duplicate relations for each criterion.
+    """
+
+    rels1 = [json.loads(line) for line in open(l1_path)]
+    rels2 = [json.loads(line) for line in open(l2_path)]
+
+    found = [(set(), set()) for _ in criteria]
+    counts = [[0, 0] for _ in criteria]
+    for i, j in candidate_pairs(rels1, rels2):
+        stats = pair_stats(rels1[i], rels2[j])
+        for c, (_, criterion) in enumerate(criteria):
+            if not criterion(stats):
+                continue
+            found1, found2 = found[c]
+            if i in found1 or j in found2:
+                counts[c][1] += 1
+                continue
+            found1.add(i)
+            found2.add(j)
+            counts[c][0] += 1
+
+    return len(rels1), len(rels2), [tuple(c) for c in counts]
+
+
+def sweep_langs(dir1, dir2, res_path, thresholds=(0.5, 0.3, 0.2, 0.1)):
+    """
+    Compute the statistics of unify_langs for several criteria
+    in one pass over the files and write them into one table.
+
+    Parameters
+    ----------
+    dir1 : str
+        Path to first directory.
+    dir2 : str
+        Path to second directory.
+    res_path : str
+        Path to write the table to.
+    thresholds : [float]
+        Overlap thresholds for criteria like unify_rels_orig.
+    """
+    fns_both = sorted(set(os.listdir(dir1)) & set(os.listdir(dir2)))
+    criteria = sweep_criteria(thresholds)
+
+    tot1, tot2 = 0, 0
+    tot_counts = [[0, 0] for _ in criteria]
+    for fn in tqdm(fns_both):
+        path1 = os.path.join(dir1, fn)
+        path2 = os.path.join(dir2, fn)
+        rels1, rels2, counts = sweep_files(path1, path2, criteria)
+        tot1 += rels1
+        tot2 += rels2
+        for c, (aligned, dupl) in enumerate(counts):
+            tot_counts[c][0] += aligned
+            tot_counts[c][1] += dupl
+
+    outs = ""
+    outs += dir1 + "\n"
+    outs += dir2 + "\n"
+    outs += "total 1: " + str(tot1) + "\n"
+    outs += "total 2: " + str(tot2) + "\n\n"
+    outs += "criterion\taligned\tdupl\tfrac al 1\tfrac dup 1\tfrac al 2\tfrac dup 2\n"
+    for (name, _), (aligned, dupl) in zip(criteria, tot_counts):
+        row = [name, str(aligned), str(dupl)]
+        for tot in [tot1, tot2]:
+            if tot > 0:
+                row += ["{:.4f}".format(aligned / tot), "{:.4f}".format(dupl / tot)]
+            else:
+                row += ["", ""]
+        outs += "\t".join(row) + "\n"
+
+    with open(res_path, "w") as res_file:
+        res_file.write(outs)
@@ -1,6 +1,10 @@
 import json
 import os
-from tqdm import tqdm
+import shutil
+import heapq
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from parallel import process_files
 
 
 def unify_rels(rel1, rel2):
@@ -30,11 +34,13 @@ def unify_rels(rel1, rel2):
     rel2_arg1 = rel2["Arg1"]["TokenList"]
     rel2_arg2 = rel2["Arg2"]["TokenList"]
 
-    arg1_common = [ind for ind in rel1_arg1 if ind in rel2_arg1]
+    rel2_arg1_set = set(rel2_arg1)
+    arg1_common = [ind for ind in rel1_arg1 if ind in rel2_arg1_set]
     if len(arg1_common) < len(rel1_arg1) / 2 or len(arg1_common) < len(rel2_arg1) / 2:
         return None
 
-    arg2_common = [ind for ind in rel1_arg2 if ind in rel2_arg2]
+    rel2_arg2_set = set(rel2_arg2)
+    arg2_common = [ind for ind in rel1_arg2 if ind in rel2_arg2_set]
     if len(arg2_common) < len(rel1_arg2) / 2 or len(arg2_common) < len(rel2_arg2) / 2:
         return None
 
@@ -50,6 +56,7 @@ def unify_rels(rel1, rel2):
     else:
         new_rel = rel1
         connective = []
+    connective = set(connective)
     arg1_comb = [ind for ind in arg1_comb if not ind in connective]
     arg2_comb = [ind for ind in arg2_comb if not ind in connective]
 
@@ -89,12 +96,10 @@ def unify_rels_one_word(rel1, rel2):
     rel2_arg1 = rel2["Arg1"]["TokenList"]
     rel2_arg2 = rel2["Arg2"]["TokenList"]
 
-    arg1_common = [ind for ind in rel1_arg1 if ind in rel2_arg1]
-    if len(arg1_common) == 0:
+    if set(rel1_arg1).isdisjoint(rel2_arg1):
         return None
 
-    arg2_common = [ind for ind in rel1_arg2 if ind in rel2_arg2]
-    if len(arg2_common) == 0:
+    if set(rel1_arg2).isdisjoint(rel2_arg2):
         return None
 
     arg1_comb = list(set(rel1_arg1 + rel2_arg1))
@@ -109,6 +114,7 @@ def unify_rels_one_word(rel1, rel2):
     else:
         new_rel = rel1
         connective = []
+    connective = set(connective)
     arg1_comb = [ind for ind in arg1_comb if not ind in connective]
     arg2_comb = [ind for ind in arg2_comb if not ind in connective]
 
@@ -118,6 +124,74 @@ def unify_rels_one_word(rel1, rel2):
     return new_rel
 
 
+def _add_to_index(index, j, rel):
+    """
+    Add the words of both arguments of a relation to a relation index.
+    """
+    arg1_map, arg2_map = index.setdefault(tuple(rel["Sense"]), (dict(), dict()))
+    for ind in rel["Arg1"]["TokenList"]:
+        arg1_map.setdefault(ind, set()).add(j)
+    for ind in rel["Arg2"]["TokenList"]:
+        arg2_map.setdefault(ind, set()).add(j)
+
+
+def index_rels(rels):
+    """
+    Index relations by sense and by the words in their arguments.
+
+    Parameters
+    ----------
+    rels : [dict()]
+        Relations to index.
+
+    Returns
+    -------
+    index : dict()
+        Maps each sense to two dicts, which map the word indices
+        in Arg1 and Arg2 respectively to the positions of the
+        relations containing them.
+    """
+
+    index = dict()
+    for j, rel in enumerate(rels):
+        _add_to_index(index, j, rel)
+    return index
+
+
+def find_candidates(index, rel):
+    """
+    Find the indexed relations that have the same sense as a relation
+    and share at least one word with it in each argument.
+
+    Parameters
+    ----------
+    index : dict()
+        Relation index as returned by index_rels.
+    rel : dict()
+        Relation to find candidates for.
+
+    Returns
+    -------
+    candidates : set(int)
+        Positions of the candidate relations.
+    """
+
+    sense = tuple(rel["Sense"])
+    if sense not in index:
+        return set()
+    arg1_map, arg2_map = index[sense]
+
+    cands1 = set()
+    for ind in rel["Arg1"]["TokenList"]:
+        cands1.update(arg1_map.get(ind, ()))
+    if len(cands1) == 0:
+        return cands1
+    cands2 = set()
+    for ind in rel["Arg2"]["TokenList"]:
+        cands2.update(arg2_map.get(ind, ()))
+    return cands1 & cands2
+
+
 def unify_files(l1_path, l2_path, out_path, keep_single=False):
     """
     For one speech, unify the relations found from two languages.
@@ -151,13 +225,29 @@ def unify_files(l1_path, l2_path, out_path, keep_single=False):
         rels2.append(rel)
 
     found_rels = []
+    index = index_rels(rels2)
 
     for i, rel1 in enumerate(rels1):
-        for j, rel2 in enumerate(rels2):
-            #new_rel = unify_rels(rel1, rel2)
-            new_rel = unify_rels_one_word(rel1, rel2)
-            if not new_rel is None:
-                found_rels.append((i,j,new_rel))
+        # only compare to relations sharing words in both arguments,
+        # in the same order as comparing to all relations
+        queue = sorted(find_candidates(index, rel1))
+        queued = set(queue)
+        while queue:
+            j = heapq.heappop(queue)
+            #new_rel = unify_rels(rel1, rels2[j])
+            new_rel = unify_rels_one_word(rel1, rels2[j])
+            if new_rel is None:
+                continue
+            found_rels.append((i,j,new_rel))
+            # the combined relation replaces one of the two,
+            # which can thereby overlap with further relations
+            if new_rel is rel1:
+                for k in find_candidates(index, rel1):
+                    if k > j and not k in queued:
+                        heapq.heappush(queue, k)
+                        queued.add(k)
+            else:
+                _add_to_index(index, j, new_rel)
 
     new_rels = []
     for i, j, new_rel in found_rels:
@@ -182,7 +272,18 @@ def unify_files(l1_path, l2_path, out_path, keep_single=False):
             out_file.write("\n")
 
 
-def unify_langs(dir1, dir2, out_dir, keep_files=False, keep_rels=False):
+def _unify_files_worker(fn, dir1, dir2, out_dir, keep_rels):
+    """
+    Call unify_files for one filename in a worker process.
+    """
+    path1 = os.path.join(dir1, fn)
+    path2 = os.path.join(dir2, fn)
+    out_path = os.path.join(out_dir, fn)
+    unify_files(path1, path2, out_path, keep_single=keep_rels)
+
+
+def unify_langs(dir1, dir2, out_dir, keep_files=False, keep_rels=False,
+                workers=1):
     """
     Combine relations for files in two directories.
 
@@ -199,31 +300,180 @@ def unify_langs(dir1, dir2, out_dir, keep_files=False, keep_rels=False):
     keep_rels : bool
         When processing two files, keep relations
         that only occur in one of them.
+    workers : int
+        Number of processes to use for unifying files,
+        and of threads to use for copying files.
     """
     fns1 = set(os.listdir(dir1))
     fns2 = set(os.listdir(dir2))
 
-    fns_both = [fn for fn in fns1 if fn in fns2]
+    fns_both = sorted(fns1 & fns2)
     num_files = len(fns_both)
 
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    for fn in tqdm(fns_both):
-        path1 = os.path.join(dir1, fn)
-        path2 = os.path.join(dir2, fn)
-        out_path = os.path.join(out_dir, fn)
-        unify_files(path1, path2, out_path, keep_single=keep_rels)
+    unify_fn = functools.partial(_unify_files_worker, dir1=dir1, dir2=dir2,
+                                 out_dir=out_dir, keep_rels=keep_rels)
+    process_files(unify_fn, fns_both, workers)
 
     if keep_files:
-        fns1 = [fn for fn in fns1 if fn not in fns_both]
-        fns2 = [fn for fn in fns2 if fn not in fns_both]
-        for fn in fns1:
-            prev_path = os.path.join(dir1, fn)
-            new_path = os.path.join(out_dir, fn)
-            shutil.copy(prev_path, new_path)
-        for fn in fns2:
-            prev_path = os.path.join(dir2, fn)
-            new_path = os.path.join(out_dir, fn)
-            shutil.copy(prev_path, new_path)
+        to_copy = []
+        for fn in sorted(fns1 - fns2):
+            to_copy.append((os.path.join(dir1, fn), os.path.join(out_dir, fn)))
+        for fn in sorted(fns2 - fns1):
+            to_copy.append((os.path.join(dir2, fn), os.path.join(out_dir, fn)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda paths: shutil.copy(*paths), to_copy))
+
+
+def _combine_cluster(rels):
+    """
+    Combine a cluster of matching relations into one relation.
+    The arguments are the union of the arguments of all relations.
+    If one of the relations is explicit, the first explicit relation
+    provides type and connective.
+    """
+    explicit = [rel for rel in rels if rel["Type"] == "Explicit"]
+    if len(explicit) > 0:
+        base = explicit[0]
+        connective = set(base["Connective"]["TokenList"])
+    else:
+        base = rels[0]
+        connective = set()
+
+    arg1_comb = set()
+    arg2_comb = set()
+    for rel in rels:
+        arg1_comb.update(rel["Arg1"]["TokenList"])
+        arg2_comb.update(rel["Arg2"]["TokenList"])
+
+    new_rel = dict(base)
+    new_rel["Arg1"] = dict(base["Arg1"])
+    new_rel["Arg1"]["TokenList"] = sorted(arg1_comb - connective)
+    new_rel["Arg2"] = dict(base["Arg2"])
+    new_rel["Arg2"]["TokenList"] = sorted(arg2_comb - connective)
+    return new_rel
+
+
+def unify_files_multi(paths, langs, out_path, min_langs=2):
+    """
+    For one speech, unify the relations found from any number of languages.
+    Relations from different languages are linked, if they have
+    the same sense and share at least one word in each argument.
+    Each group of linked relations is combined into one relation.
+    A group holds at most one relation per language: two groups are
+    only joined if they don't have a language in common, so that separate
+    relations of one language are never chained into one.
+    Links are tried in the order of the relations, earlier links win.
+
+    Parameters
+    ----------
+    paths : [str]
+        Paths to the relations files for the languages.
+        Paths that don't exist are skipped.
+    langs : [str]
+        Names of the languages.
+    out_path : str
+        Path to save the result to.
+    min_langs : int
+        Only keep combined relations that were found
+        from at least this many languages.
+    """
+
+    lang_nums = []
+    rels = []
+    for lang_num, path in enumerate(paths):
+        if not os.path.exists(path):
+            continue
+        for line in open(path):
+            lang_nums.append(lang_num)
+            rels.append(json.loads(line))
+
+    # union-find over the relations, with the languages of each group
+    parents = list(range(len(rels)))
+    group_langs = [set([lang_num]) for lang_num in lang_nums]
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    index = index_rels(rels)
+    for i, rel in enumerate(rels):
+        for j in sorted(find_candidates(index, rel)):
+            if j <= i:
+                continue
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j or group_langs[root_i] & group_langs[root_j]:
+                continue
+            parents[root_j] = root_i
+            group_langs[root_i] |= group_langs[root_j]
+
+    clusters = dict()
+    for i in range(len(rels)):
+        clusters.setdefault(find(i), []).append(i)
+
+    new_rels = []
+    for members in sorted(clusters.values()):
+        found_in = sorted(set(lang_nums[i] for i in members))
+        if len(found_in) < min_langs:
+            continue
+        new_rel = _combine_cluster([rels[i] for i in members])
+        new_rel["languages"] = [langs[l] for l in found_in]
+        new_rels.append(new_rel)
+
+    for i, rel in enumerate(new_rels):
+        rel["ID"] = i
+
+    with open(out_path, "w") as out_file:
+        for rel in new_rels:
+            json.dump(rel,out_file)
+            out_file.write("\n")
+
+
+def _unify_files_multi_worker(fn, dirs, langs, out_dir, min_langs):
+    """
+    Call unify_files_multi for one filename in a worker process.
+    """
+    paths = [os.path.join(dir_name, fn) for dir_name in dirs]
+    out_path = os.path.join(out_dir, fn)
+    unify_files_multi(paths, langs, out_path, min_langs=min_langs)
+
+
+def unify_langs_multi(dirs, out_dir, min_langs=2, langs=None, workers=1):
+    """
+    Combine relations for files in any number of directories in one pass.
+    Each relation in the output lists the languages it was found from.
+
+    Parameters
+    ----------
+    dirs : [str]
+        Paths to the directories.
+    out_dir : str
+        Directory to save results to.
+    min_langs : int
+        Only keep relations that were found from at least
+        this many languages. Files that occur in fewer directories
+        are skipped.
+    langs : [str] or None
+        Names of the languages. If None, the directory names are used.
+    workers : int
+        Number of processes to use.
+    """
+
+    if langs is None:
+        langs = [os.path.basename(os.path.normpath(d)) for d in dirs]
+
+    fn_counts = dict()
+    for dir_name in dirs:
+        for fn in os.listdir(dir_name):
+            fn_counts[fn] = fn_counts.get(fn, 0) + 1
+    fns = sorted(fn for fn in fn_counts if fn_counts[fn] >= min_langs)
+
+    if not os.path.exists(out_dir):
+        os.mkdir(out_dir)
 
+    unify_fn = functools.partial(_unify_files_multi_worker, dirs=dirs, langs=langs,
+                                 out_dir=out_dir, min_langs=min_langs)
+    process_files(unify_fn, fns, workers)
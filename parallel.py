@@ -0,0 +1,69 @@
+import multiprocessing as mp
+from tqdm import tqdm
+
+
+def imap_files(func, fns, workers, ordered=False, initializer=None, initargs=()):
+    """
+    Call a function for each filename, sequentially or in worker processes,
+    and yield the results while showing progress.
+
+    The worker processes are forked, so they share the data
+    the parent process has already loaded.
+
+    Parameters
+    ----------
+    func : <function>
+        Function to call with each filename.
+    fns : [str]
+        Filenames, or other items to call the function with.
+    workers : int
+        Number of processes to use.
+    ordered : bool
+        Whether to yield the results in the order of fns.
+        Otherwise they are yielded as soon as they are ready.
+    initializer : <function> or None
+        Function to call once in each worker process.
+    initargs : tuple
+        Arguments for the initializer.
+
+    Return
+    ------
+    results : generator
+        Return value of func for each filename.
+    """
+
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for fn in tqdm(fns):
+            yield func(fn)
+        return
+
+    # several files per task, but enough tasks to balance the load
+    chunksize = max(1, len(fns) // (workers * 16))
+    with mp.get_context("fork").Pool(workers, initializer=initializer,
+                                     initargs=initargs) as pool:
+        if ordered:
+            results = pool.imap(func, fns, chunksize)
+        else:
+            results = pool.imap_unordered(func, fns, chunksize)
+        for res in tqdm(results, total=len(fns)):
+            yield res
+
+
+def process_files(func, fns, workers):
+    """
+    Call a function for each filename, sequentially or in worker processes.
+    The files have to be independent, as the order isn't fixed.
+
+    Parameters
+    ----------
+    func : <function>
+        Function to call with each filename.
+    fns : [str]
+        Filenames.
+    workers : int
+        Number of processes to use.
+    """
+    for _ in imap_files(func, fns, workers):
+        pass
@@ -0,0 +1,294 @@
+import os
+import json
+import numpy as np
+from parallel import imap_files
+
+
+ARGS = ["Arg1", "Arg2", "Connective"]
+
+
+def token_inds(token_list):
+    """
+    Get word indices from a TokenList.
+
+    Parameters
+    ----------
+    token_list : list
+        TokenList of a relation argument, either word indices or,
+        as in the CoNLL output format, lists containing the word index.
+
+    Return
+    ------
+    inds : [int]
+        Word indices, in the order of the TokenList.
+    """
+    if len(token_list) > 0 and isinstance(token_list[0], list):
+        # this is the case when we use the output of the GermanShallowDiscourseParser
+        token_list = [l[2] for l in token_list]
+    return token_list
+
+
+def _read_file_columns(rel_path):
+    """
+    Read the relations of one file into lists, one per column.
+    """
+    columns = {"ID": [], "Type": [], "orig_type": [], "Sense": []}
+    for arg in ARGS:
+        columns[arg] = []
+    with open(rel_path) as rel_file:
+        for line in rel_file:
+            relation = json.loads(line)
+            columns["ID"].append(relation["ID"])
+            columns["Type"].append(relation["Type"])
+            columns["orig_type"].append(relation.get("orig_type", ""))
+            columns["Sense"].append(relation["Sense"][0])
+            for arg in ARGS:
+                columns[arg].append(token_inds(relation[arg]["TokenList"]))
+    return columns
+
+
+def _encode(values, vocab, codes):
+    """
+    Replace strings with their index in the vocabulary,
+    adding new strings to it.
+    """
+    encoded = []
+    for value in values:
+        if value not in codes:
+            codes[value] = len(vocab)
+            vocab.append(value)
+        encoded.append(codes[value])
+    return encoded
+
+
+def build_store(rel_dir, workers=1):
+    """
+    Read a directory of relations into columns.
+
+    Each relation is one row. Strings are stored as indices
+    into vocabularies, the token lists of each argument as one flat array
+    with offsets, i.e. the Arg1 tokens of relation i are
+    arg1_tokens[arg1_offsets[i]:arg1_offsets[i+1]].
+
+    Parameters
+    ----------
+    rel_dir : str
+        Directory containing relations, one json file per document.
+    workers : int
+        Number of processes to read files in.
+
+    Return
+    ------
+    store : dict
+        Columns as numpy arrays:
+        "doc" and "docs" (file names), "id", "type", "orig_type" and "types",
+        "sense" and "senses", and "<arg>_tokens" and "<arg>_offsets"
+        for arg1, arg2 and connective.
+        Relations without orig_type have the type "".
+    """
+
+    fns = sorted(os.listdir(rel_dir))
+    paths = [os.path.join(rel_dir, fn) for fn in fns]
+
+    docs, ids = [], []
+    types, type_codes = [], dict()
+    senses, sense_codes = [], dict()
+    type_col, orig_type_col, sense_col = [], [], []
+    tokens = dict((arg, []) for arg in ARGS)
+    lengths = dict((arg, []) for arg in ARGS)
+
+    file_columns = imap_files(_read_file_columns, paths, workers, ordered=True)
+    for doc, columns in enumerate(file_columns):
+        docs += [doc] * len(columns["ID"])
+        ids += columns["ID"]
+        type_col += _encode(columns["Type"], types, type_codes)
+        orig_type_col += _encode(columns["orig_type"], types, type_codes)
+        sense_col += _encode(columns["Sense"], senses, sense_codes)
+        for arg in ARGS:
+            for token_list in columns[arg]:
+                tokens[arg] += token_list
+                lengths[arg].append(len(token_list))
+
+    store = {
+        "docs": np.array(fns, dtype=str),
+        "doc": np.array(docs, dtype=np.int32),
+        "id": np.array(ids, dtype=np.int64),
+        "types": np.array(types, dtype=str),
+        "type": np.array(type_col, dtype=np.int32),
+        "orig_type": np.array(orig_type_col, dtype=np.int32),
+        "senses": np.array(senses, dtype=str),
+        "sense": np.array(sense_col, dtype=np.int32),
+    }
+    for arg in ARGS:
+        offsets = np.zeros(len(lengths[arg]) + 1, dtype=np.int64)
+        np.cumsum(lengths[arg], out=offsets[1:])
+        store[arg.lower() + "_tokens"] = np.array(tokens[arg], dtype=np.int64)
+        store[arg.lower() + "_offsets"] = offsets
+    return store
+
+
+def save_store(store, store_path):
+    """
+    Save columns as an npz file.
+
+    Parameters
+    ----------
+    store : dict
+        Columns as returned by build_store.
+    store_path : str
+        Path to write to.
+    """
+    with open(store_path, "wb") as store_file:
+        np.savez(store_file, **store)
+
+
+def load_store(store_path):
+    """
+    Load columns saved with save_store.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to npz file.
+
+    Return
+    ------
+    store : dict
+        Columns as returned by build_store.
+    """
+    with np.load(store_path) as npz:
+        return dict((key, npz[key]) for key in npz.files)
+
+
+def export_dir(rel_dir, store_path, workers=1):
+    """
+    Convert a directory of relations into an npz file of columns.
+
+    Parameters
+    ----------
+    rel_dir : str
+        Directory containing relations.
+    store_path : str
+        Path to write to.
+    workers : int
+        Number of processes to read files in.
+    """
+    save_store(build_store(rel_dir, workers=workers), store_path)
+
+
+def _sense_level(senses, level):
+    """
+    Cut the senses of a vocabulary to their first levels.
+    Return the new vocabulary and for each old sense its new index.
+    """
+    if level is None:
+        return senses, np.arange(len(senses))
+    cut = np.array([".".join(s.split(".")[:level]) for s in senses], dtype=str)
+    return np.unique(cut, return_inverse=True)
+
+
+def _type_code(store, rel_type):
+    """
+    Find the index of a type, -1 if it doesn't occur.
+    """
+    found = np.flatnonzero(store["types"] == rel_type)
+    return found[0] if len(found) > 0 else -1
+
+
+def sense_counts(store, level=None, rel_type=None):
+    """
+    Count how often each sense occurs.
+
+    Parameters
+    ----------
+    store : dict
+        Columns as returned by build_store or load_store.
+    level : int or None
+        Number of sense levels to count. None for whole senses.
+    rel_type : str or None
+        Only count relations of this type.
+
+    Return
+    ------
+    counts : dict
+        Number of relations for each sense.
+    """
+
+    senses, sense_map = _sense_level(store["senses"], level)
+    rel_senses = sense_map[store["sense"]]
+    if rel_type is not None:
+        rel_senses = rel_senses[store["type"] == _type_code(store, rel_type)]
+    counts = np.bincount(rel_senses, minlength=len(senses))
+    return dict((s, int(c)) for s, c in zip(senses.tolist(), counts.tolist()) if c > 0)
+
+
+def arg_lengths(store, arg="Arg1"):
+    """
+    Get the number of tokens of an argument for every relation.
+
+    Parameters
+    ----------
+    store : dict
+        Columns as returned by build_store or load_store.
+    arg : str
+        "Arg1", "Arg2" or "Connective".
+
+    Return
+    ------
+    lengths : numpy.ndarray
+        Length of the argument for each relation.
+    """
+    return np.diff(store[arg.lower() + "_offsets"])
+
+
+def arg_length_by_sense(store, arg="Arg1", level=None):
+    """
+    Compute the mean length of an argument for each sense.
+
+    Parameters
+    ----------
+    store : dict
+        Columns as returned by build_store or load_store.
+    arg : str
+        "Arg1", "Arg2" or "Connective".
+    level : int or None
+        Number of sense levels to distinguish. None for whole senses.
+
+    Return
+    ------
+    mean_lengths : dict
+        Mean argument length for each sense.
+    """
+
+    senses, sense_map = _sense_level(store["senses"], level)
+    rel_senses = sense_map[store["sense"]]
+    counts = np.bincount(rel_senses, minlength=len(senses))
+    totals = np.bincount(rel_senses, weights=arg_lengths(store, arg),
+                         minlength=len(senses))
+    return dict((s, t / c) for s, t, c in
+                zip(senses.tolist(), totals.tolist(), counts.tolist()) if c > 0)
+
+
+def type_transitions(store):
+    """
+    Count how often relations of one original type
+    ended up with another type, e.g. after the transfer to German.
+
+    Parameters
+    ----------
+    store : dict
+        Columns as returned by build_store or load_store.
+
+    Return
+    ------
+    transitions : numpy.ndarray
+        transitions[s, o, t] is the number of relations with sense s,
+        original type o and type t,
+        indexed like store["senses"] and store["types"].
+    """
+
+    num_types = len(store["types"])
+    num_senses = len(store["senses"])
+    cells = (store["sense"] * num_types + store["orig_type"]) * num_types + store["type"]
+    counts = np.bincount(cells, minlength=num_senses * num_types * num_types)
+    return counts.reshape(num_senses, num_types, num_types)
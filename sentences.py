@@ -0,0 +1,131 @@
+import io
+import numpy as np
+import nltk
+from cache import hash_cached
+
+
+def sentence_starts(sents):
+    """
+    Compute the word index at which each sentence of a document begins.
+
+    Parameters
+    ----------
+    sents : [[str]]
+        Sentences of the document, each one a list of words.
+
+    Return
+    ------
+    starts : numpy.ndarray
+        Index of the first word of each sentence,
+        followed by the number of words in the document.
+    """
+
+    starts = np.zeros(len(sents) + 1, dtype=np.int64)
+    np.cumsum([len(sent) for sent in sents], out=starts[1:])
+    return starts
+
+
+def _split_sents(text, split_lines):
+    """
+    Split a text into sentences of words. Each line is one sentence,
+    unless split_lines is true, then lines are split with nltk.
+    """
+    sents = []
+    for line in io.StringIO(text, newline=None):
+        if split_lines:
+            sents += [s.split() for s in nltk.sent_tokenize(line)]
+        else:
+            sents.append(line.split())
+    return sents
+
+
+def read_sentence_starts(txt_path, split_lines=False, cache_dir=None):
+    """
+    Read a text file and compute where its sentences begin.
+    With a cache directory, the result is saved there
+    under the SHA-1 of the text, so that each text is only split once.
+
+    Parameters
+    ----------
+    txt_path : str
+        Path to the text file.
+    split_lines : bool
+        Whether lines may contain several sentences and are split
+        with nltk.sent_tokenize, as for the PCC.
+        Otherwise each line is one sentence.
+    cache_dir : str or None
+        Directory to keep sentence starts in.
+
+    Return
+    ------
+    starts : numpy.ndarray
+        Sentence starts as returned by sentence_starts.
+    """
+
+    with open(txt_path, "rb") as txt_file:
+        data = txt_file.read()
+
+    mode = "nltk" if split_lines else "lines"
+    return hash_cached(data, cache_dir, "." + mode + ".npy",
+                       lambda: sentence_starts(_split_sents(data.decode("utf-8"), split_lines)),
+                       np.save, np.load)
+
+
+def sentence_ids(starts, inds):
+    """
+    Find the sentence each word belongs to.
+
+    Parameters
+    ----------
+    starts : numpy.ndarray
+        Sentence starts as returned by sentence_starts.
+    inds : [int]
+        Word indices.
+
+    Return
+    ------
+    sent_ids : numpy.ndarray
+        Sentence index for each word.
+        -1 for words that are not part of the document.
+    """
+
+    inds = np.fromiter(inds, dtype=np.int64)
+    sent_ids = np.searchsorted(starts, inds, side="right") - 1
+    sent_ids[(inds < 0) | (inds >= starts[-1])] = -1
+    return sent_ids
+
+
+def single_sent(i_inds, e_inds, starts):
+    """
+    Return true, if each argument of the relation
+    is contained in one sentence each.
+    Also count as true, if the last word of the argument is
+    in the next sentence.
+
+    More precisely, the first argument has at least one word
+    in some sentence and at most one word outside of it,
+    and the second argument has a word in the previous or next sentence.
+
+    Parameters
+    ----------
+    i_inds : [int]
+        Word indices of the first argument.
+    e_inds : [int]
+        Word indices of the second argument.
+    starts : numpy.ndarray
+        Sentence starts as returned by sentence_starts.
+    """
+
+    num_sents = len(starts) - 1
+    i_sents = sentence_ids(starts, i_inds)
+    e_sents = set(sentence_ids(starts, e_inds).tolist())
+
+    sent_ids, counts = np.unique(i_sents[i_sents >= 0], return_counts=True)
+    for j, count in zip(sent_ids.tolist(), counts.tolist()):
+        if len(i_sents) - count >= 2:
+            continue
+        if j < num_sents - 1 and j + 1 in e_sents:
+            return True
+        if j > 0 and j - 1 in e_sents:
+            return True
+    return False
@@ -2,10 +2,16 @@ import os
 import json
 import xml.etree.ElementTree as ET
 from tqdm import tqdm
-import random
+import numpy as np
+import hashlib
+import pickle
+import functools
+from sentences import read_sentence_starts, single_sent
+from parallel import imap_files, process_files
+from cache import hash_cached
 
 
-def read_alignments(align_path):
+def read_alignments(align_path, reverse=False):
     """
     Read alignments from file. Translate the
     alignment indices from numbering the words
@@ -14,36 +20,158 @@ def read_alignments(align_path):
     words, then the first word of the second sentence
     will be labeled as 5 instead of 0.)
 
+    The alignments are stored in compressed sparse row layout:
+    the German word indices aligned to English word i are
+    targets[offsets[i]:offsets[i+1]], in the order of the file.
+
     Parameters
     ----------
     align_path : str
         Path to file containing the alignments.
+    reverse : bool
+        If True, map German word indices to English ones instead.
 
     Return
     ------
-    alignments : dict(int)
-        Dictionary assigning a list of German word indices
-        words to each English word index.
+    alignments : (numpy.ndarray, numpy.ndarray)
+        Offsets and targets of the alignments.
     """
 
     align_tuples = []
-
-    alignments = dict()
     with open(align_path) as align_file:
         for line in align_file:
-            if line.strip() == "":
-                continue
-            algmts = line[:-1].split(" ")
-            algmts = [al.split("-") for al in algmts]
-            for de, en in algmts:
-                de = int(de) - 1
-                en = int(en) - 1
-                if en in alignments:
-                    alignments[en].append(de)
-                else:
-                    alignments[en] = [de]
+            for al in line.split():
+                de, en = al.split("-")
+                align_tuples.append((int(en) - 1, int(de) - 1))
+
+    align_tuples = np.array(align_tuples, dtype=np.int64).reshape(-1, 2)
+    if reverse:
+        align_tuples = align_tuples[:, ::-1]
+    align_tuples = align_tuples[align_tuples[:, 0] >= 0]
+    sources = align_tuples[:, 0]
+
+    order = np.argsort(sources, kind="stable")
+    targets = align_tuples[order, 1]
+    counts = np.bincount(sources)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return offsets, targets
+
+
+def _project(alignments, inds):
+    """
+    Project an array of word indices.
+    Return the projected indices and, for each word index,
+    the number of indices it was projected to.
+    """
+    offsets, targets = alignments
+    valid = (inds >= 0) & (inds < len(offsets) - 1)
+    starts = np.zeros(len(inds), dtype=np.int64)
+    starts[valid] = offsets[inds[valid]]
+    lengths = np.zeros(len(inds), dtype=np.int64)
+    lengths[valid] = offsets[inds[valid] + 1] - starts[valid]
+    # position of each projected index in targets
+    shifts = starts - np.cumsum(lengths) + lengths
+    gather = np.repeat(shifts, lengths) + np.arange(lengths.sum())
+    return targets[gather], lengths
+
+
+def project_tokens(alignments, tok_list):
+    """
+    Replace a list of word indices with the aligned word indices
+    in the other language. Words without alignment are dropped.
+
+    Parameters
+    ----------
+    alignments : (numpy.ndarray, numpy.ndarray)
+        Alignments as returned by read_alignments.
+    tok_list : [int]
+        Word indices to project.
+
+    Return
+    ------
+    projected : numpy.ndarray
+        Aligned word indices.
+    """
+
+    inds = np.asarray(tok_list, dtype=np.int64)
+    projected, _ = _project(alignments, inds)
+    return projected
+
+
+def _project_arg(relations, arg, alignments):
+    """
+    Project one argument of all relations of a document at once.
+    Return the flat projected word indices and the offsets
+    of each relation in them.
+    """
+    lengths = [len(rel[arg]["TokenList"]) for rel in relations]
+    flat_offsets = np.zeros(len(relations) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=flat_offsets[1:])
+    flat = np.fromiter((i for rel in relations for i in rel[arg]["TokenList"]),
+                       dtype=np.int64, count=flat_offsets[-1])
+    projected, proj_lengths = _project(alignments, flat)
+
+    proj_offsets = np.zeros(len(flat) + 1, dtype=np.int64)
+    np.cumsum(proj_lengths, out=proj_offsets[1:])
+    return projected, proj_offsets[flat_offsets]
+
+
+def _arg_spans(projected, offsets):
+    """
+    For each relation, find the first and last projected word index
+    of an argument. Return them together with a mask of the relations,
+    for which the argument is not empty.
+    """
+    non_empty = offsets[1:] > offsets[:-1]
+    starts = offsets[:-1][non_empty]
+    tok_min = np.zeros(len(non_empty), dtype=np.int64)
+    tok_max = np.zeros(len(non_empty), dtype=np.int64)
+    if len(starts) > 0:
+        tok_min[non_empty] = np.minimum.reduceat(projected, starts)
+        tok_max[non_empty] = np.maximum.reduceat(projected, starts)
+    return tok_min, tok_max, non_empty
+
+
+def project_relations(relations, alignments):
+    """
+    Project all relations of a document to the German text at once.
+    The arguments are made contiguous, i.e. they span all words
+    between the first and the last projected word.
+    Relations with an empty argument after the projection are dropped.
+
+    Parameters
+    ----------
+    relations : [dict]
+        List of relations found for the file.
+    alignments : (numpy.ndarray, numpy.ndarray)
+        Alignments as returned by read_alignments.
 
-    return alignments
+    Return
+    ------
+    trans_rels : [dict]
+        Relations with transferred indices.
+    """
+
+    proj1, offsets1 = _project_arg(relations, "Arg1", alignments)
+    proj2, offsets2 = _project_arg(relations, "Arg2", alignments)
+    proj_conn, offsets_conn = _project_arg(relations, "Connective", alignments)
+
+    min1, max1, non_empty1 = _arg_spans(proj1, offsets1)
+    min2, max2, non_empty2 = _arg_spans(proj2, offsets2)
+    keep = np.flatnonzero(non_empty1 & non_empty2)
+
+    trans_rels = []
+    for i in keep:
+        relation = relations[i]
+        relation["Arg1"]["TokenList"] = list(range(min1[i], max1[i]+1))
+        relation["Arg2"]["TokenList"] = list(range(min2[i], max2[i]+1))
+        conn = proj_conn[offsets_conn[i]:offsets_conn[i+1]]
+        relation["Connective"]["TokenList"] = conn.tolist()
+        trans_rels.append(relation)
+
+    return trans_rels
 
 
 def read_relations(parsed_path):
@@ -97,24 +225,51 @@ def replace_inds(relations, align_path):
     alignments = read_alignments(align_path)
 
     for relation in relations:
-        arg1_list = relation['Arg1']['TokenList']
-        arg1_new = [alignments[n] for n in arg1_list if n in alignments]
-        arg1_new = [n for n_list in arg1_new for n in n_list]
-        relation['Arg1']['TokenList'] = arg1_new
+        for arg in ["Arg1", "Arg2", "Connective"]:
+            tok_list = relation[arg]["TokenList"]
+            relation[arg]["TokenList"] = project_tokens(alignments, tok_list).tolist()
+        trans_rels.append(relation)
 
-        arg2_list = relation['Arg2']['TokenList']
-        arg2_new = [alignments[n] for n in arg2_list if n in alignments]
-        arg2_new = [n for n_list in arg2_new for n in n_list]
-        relation['Arg2']['TokenList'] = arg2_new
+    return trans_rels
 
-        connec_list = relation['Connective']['TokenList']
-        connec_new = [alignments[n] for n in connec_list if n in alignments]
-        connec_new = [n for n_list in connec_new for n in n_list]
-        relation['Connective']['TokenList'] = connec_new
 
-        trans_rels.append(relation)
+def pdtb3_to_conll(sense):
+    """
+    Translate a PDTB3 sense into the closest CoNLL-2015 sense.
 
-    return trans_rels
+    Parameters
+    ----------
+    sense : str
+        PDTB3 sense, e.g. from DiMLex or the PCC.
+
+    Return
+    ------
+    sense_conll : str
+        CoNLL-2015 sense.
+    """
+    sense = sense.split(".")
+    if sense[-1].startswith("Arg"):
+        sense = sense[:-1]
+    sense = ".".join(sense)
+    if sense.startswith("Comparison.Concession"):
+        sense = "Comparison.Concession"
+    elif sense == "Expansion.Level-of-detail":
+        sense = "Expansion"
+    elif sense == "Expansion.Substitution":
+        sense = "Expansion"
+    elif sense == "Contingency.Negative-condition":
+        sense = "Contingency"
+    elif sense == "Contingency.Purpose":
+        sense = "Contingency"
+    elif sense == "Expansion.Manner":
+        sense = "Expansion"
+    elif sense == "Expansion.Equivalence":
+        sense = "Expansion"
+    elif sense == "Expansion.Disjunction":
+        sense = "Expansion"
+    elif sense == "Temporal.Synchronous":
+        sense = "Temporal.Synchrony"
+    return sense
 
 
 def read_dimlex(dimlex_path):
@@ -141,31 +296,7 @@ def read_dimlex(dimlex_path):
         
         senses = [rel.attrib["sense"] for rel in rels]
         #translate between pdtb and conll senses
-        senses_conll = set()
-        for sense in senses:
-            sense = sense.split(".")
-            if sense[-1].startswith("Arg"):
-                sense = sense[:-1]
-            sense = ".".join(sense)
-            if sense.startswith("Comparison.Concession"):
-                sense = "Comparison.Concession"
-            elif sense == "Expansion.Level-of-detail":
-                sense = "Expansion"
-            elif sense == "Expansion.Substitution":
-                sense = "Expansion"
-            elif sense == "Contingency.Negative-condition":
-                sense = "Contingency"
-            elif sense == "Contingency.Purpose":
-                sense = "Contingency"
-            elif sense == "Expansion.Manner":
-                sense = "Expansion"
-            elif sense == "Expansion.Equivalence":
-                sense = "Expansion"
-            elif sense == "Expansion.Disjunction":
-                sense = "Expansion"
-            elif sense == "Temporal.Synchronous":
-                sense = "Temporal.Synchrony"
-            senses_conll.add(sense)
+        senses_conll = set([pdtb3_to_conll(sense) for sense in senses])
 
         orths = entry.iter("orth")
         for orth in orths:
@@ -232,16 +363,173 @@ def is_contained(sense, senses):
     return False
 
 
-def trans_implicit(relation, dimlex_connectives, text):
+def build_connective_index(dimlex_connectives):
+    """
+    Build an index over the DiMLex connectives, so that the connectives
+    at the edges of an argument can be found without going through
+    the whole lexicon.
+
+    The index contains two token tries, one over the words of each
+    connective part and one over the reversed words. Each trie node
+    is a dict mapping a word to the next node. At the key None, a node
+    lists the connective parts ending there as (rank, part_num, length)
+    tuples, where rank is the position of the connective in the lexicon.
+
+    It also maps the surface form of each connective, i.e. the words of
+    all its parts as one tuple, to the senses the connective can have.
+
+    Parameters
+    ----------
+    dimlex_connectives : dict
+        DimLex connectives with senses, as returned by read_dimlex.
+
+    Return
+    ------
+    index : dict
+        Dictionary containing the connectives with their senses
+        in lexicon order ("connectives"), the two tries
+        ("prefix" and "suffix") and the surface forms ("surface").
+    """
+
+    connectives = list(dimlex_connectives.items())
+    prefix = dict()
+    suffix = dict()
+    surface = dict()
+    for rank, (parts, senses) in enumerate(connectives):
+        words = tuple(word for part in parts for word in part.split())
+        surface[words] = surface.get(words, frozenset()) | frozenset(senses)
+        for part_num, part in enumerate(parts[:2]):
+            words = part.split()
+            if len(words) == 0:
+                continue
+            entry = (rank, part_num, len(words))
+            for trie, ordered in [(prefix, words), (suffix, words[::-1])]:
+                node = trie
+                for word in ordered:
+                    node = node.setdefault(word, dict())
+                node.setdefault(None, []).append(entry)
+
+    index = dict()
+    index["connectives"] = connectives
+    index["prefix"] = prefix
+    index["suffix"] = suffix
+    index["surface"] = surface
+    return index
+
+
+# increase when the layout of the connective index changes,
+# so that older compiled lexicons are rebuilt
+LEXICON_VERSION = 1
+
+
+def _save_lexicon(lexicon_file, connective_index):
+    """
+    Write a compiled lexicon to an open binary file.
+    """
+    pickle.dump(connective_index, lexicon_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_lexicon(lexicon_path):
+    """
+    Read a compiled lexicon written by _save_lexicon.
+    """
+    with open(lexicon_path, "rb") as lexicon_file:
+        return pickle.load(lexicon_file)
+
+
+def load_dimlex(dimlex_path, cache_dir=None):
+    """
+    Load the connective index for DiMLex.
+    With a cache directory, the compiled index is saved there
+    under the SHA-1 of the xml file, so that it is only built once.
+
+    Parameters
+    ----------
+    dimlex_path : str
+        Path to xml file containing DiMLex.
+    cache_dir : str or None
+        Directory to keep compiled lexicons in.
+
+    Return
+    ------
+    connective_index : dict
+        Index of DimLex connectives, as returned by build_connective_index.
+        Additionally contains the hash of the xml file ("hash").
+    """
+
+    with open(dimlex_path, "rb") as dimlex_file:
+        data = dimlex_file.read()
+    dimlex_hash = hashlib.sha1(data).hexdigest()
+
+    def compile_index():
+        connective_index = build_connective_index(read_dimlex(dimlex_path))
+        connective_index["hash"] = dimlex_hash
+        return connective_index
+
+    return hash_cached(data, cache_dir, ".dimlex" + str(LEXICON_VERSION) + ".pickle",
+                       compile_index, _save_lexicon, _load_lexicon)
+
+
+def connective_senses(connective_index, words):
+    """
+    Look up the senses a connective can have in DiMLex.
+
+    Parameters
+    ----------
+    connective_index : dict
+        Index of DimLex connectives, as returned by build_connective_index.
+    words : [str]
+        Words of the connective.
+
+    Return
+    ------
+    senses : frozenset(str)
+        Senses of the connective. Empty, if it is not in DiMLex.
+    """
+    return connective_index["surface"].get(tuple(words), frozenset())
+
+
+def _edge_matches(trie, words):
+    """
+    Walk a connective trie along a sequence of words and
+    return the entries of all connective parts the sequence begins with.
+    """
+    matches = []
+    node = trie
+    for word in words:
+        node = node.get(word)
+        if node is None:
+            break
+        matches += node.get(None, [])
+    return matches
+
+
+def _split_edge(toks, length, at_start):
+    """
+    Split a number of tokens off the start or end of a token list.
+    Return the remaining tokens and the split off tokens.
+    """
+    if at_start:
+        return toks[length:], toks[:length]
+    return toks[:-length], toks[-length:]
+
+
+def trans_implicit(relation, connective_index, text):
     """
     Check if translated implicit relation has become explicit.
 
+    A connective is found, if it matches the words at the beginning
+    or end of one of the arguments. Connectives consisting of two parts
+    have to match an edge of the first and of the second argument
+    respectively. If several connectives match, the one occurring first
+    in DiMLex is used.
+
     Parameters
     ----------
     relation : dict
         Relation from output of replace_inds.
-    dimlex_connectives : dict
-        DimLex connectives with senses.
+    connective_index : dict
+        Index of DimLex connectives, as returned by build_connective_index.
     text : [str]
         Text of for which the relation has been found.
     """
@@ -250,96 +538,50 @@ def trans_implicit(relation, dimlex_connectives, text):
     sense = relation["Sense"][0]
     relation["orig_type"] = "Implicit"
 
-    for connective in dimlex_connectives:
-        senses = dimlex_connectives[connective]
-        if not is_contained(sense,senses):
+    # argument edges in the order in which they are checked
+    edges = [("Arg1", True), ("Arg1", False), ("Arg2", True), ("Arg2", False)]
+    found = dict()
+    for edge_num, (arg, at_start) in enumerate(edges):
+        words = text1 if arg == "Arg1" else text2
+        if at_start:
+            matches = _edge_matches(connective_index["prefix"], words)
+        else:
+            matches = _edge_matches(connective_index["suffix"], words[::-1])
+        for rank, part_num, length in matches:
+            part_matches = found.setdefault(rank, dict())
+            part_matches.setdefault(part_num, []).append((edge_num, length))
+
+    connectives = connective_index["connectives"]
+    for rank in sorted(found):
+        parts, senses = connectives[rank]
+        if not is_contained(sense, senses):
             continue
 
-        if len(connective) == 1:
-            words = connective[0].split()
-            if text1[:len(words)] == words:
-                #first argument begins with connective
-                toks = relation["Arg1"]["TokenList"]
-                new_conn = toks[:len(words)]
-                tok_new = toks[len(words):]
-                relation["Arg1"]["TokenList"] = tok_new
-                relation["Connective"]["TokenList"] = new_conn
-                relation["Type"] = "Explicit"
-                return relation
-            if text1[-len(words):] == words:
-                #first argument ends with connective
-                toks = relation["Arg1"]["TokenList"]
-                new_conn = toks[-len(words):]
-                tok_new = toks[:-len(words)]
-                relation["Arg1"]["TokenList"] = tok_new
-                relation["Connective"]["TokenList"] = new_conn
-                relation["Type"] = "Explicit"
-                return relation
-            if text2[:len(words)] == words:
-                #second argument begins with connective
-                toks = relation["Arg2"]["TokenList"]
-                new_conn = toks[:len(words)]
-                tok_new = toks[len(words):]
-                relation["Arg2"]["TokenList"] = tok_new
-                relation["Connective"]["TokenList"] = new_conn
-                relation["Type"] = "Explicit"
-                return relation
-            if text2[-len(words):] == words:
-                #first argument ends with connective
-                toks = relation["Arg2"]["TokenList"]
-                new_conn = toks[-len(words):]
-                tok_new = toks[:-len(words)]
-                relation["Arg2"]["TokenList"] = tok_new
-                relation["Connective"]["TokenList"] = new_conn
-                relation["Type"] = "Explicit"
-                return relation
+        if len(parts) == 1:
+            to_split = [found[rank][0][0]]
         else: #spelling consists of two parts
-            words1 = connective[0].split()
-            words2 = connective[1].split()
-            new_rel = relation
-            found1, found2 = False, False
-            if text1[:len(words1)] == words1:
-                #first argument begins with connective
-                toks = new_rel["Arg1"]["TokenList"]
-                new_conn = toks[:len(words)]
-                tok_new = toks[len(words):]
-                new_rel["Arg1"]["TokenList"] = tok_new
-                new_rel["Connective"]["TokenList"] += new_conn
-                new_rel["Type"] = "Explicit"
-                found1 = True
-            if text1[-len(words):] == words:
-                #first argument ends with connective
-                toks = new_rel["Arg1"]["TokenList"]
-                new_conn = toks[-len(words):]
-                tok_new = toks[:-len(words)]
-                new_rel["Arg1"]["TokenList"] = tok_new
-                new_rel["Connective"]["TokenList"] += new_conn
-                new_rel["Type"] = "Explicit"
-                found1 = True
-            if text2[:len(words)] == words2:
-                #second argument begins with connective
-                toks = new_rel["Arg2"]["TokenList"]
-                new_conn = toks[:len(words)]
-                tok_new = toks[len(words):]
-                new_rel["Arg2"]["TokenList"] = tok_new
-                new_rel["Connective"]["TokenList"] = new_conn
-                new_rel["Type"] = "Explicit"
-                found2 = True
-            if text2[-len(words):] == words2:
-                #first argument ends with connective
-                toks = new_rel["Arg2"]["TokenList"]
-                new_conn = toks[-len(words):]
-                tok_new = toks[:-len(words)]
-                new_rel["Arg2"]["TokenList"] = tok_new
-                new_rel["Connective"]["TokenList"] = new_conn
-                new_rel["Type"] = "Explicit"
-                found2 = True
-            if found1 and found2:
-                return new_rel
+            # the first part has to be at the first argument
+            # and the second part at the second argument
+            first = [m for m in found[rank].get(0, []) if m[0] < 2]
+            second = [m for m in found[rank].get(1, []) if m[0] >= 2]
+            if first == [] or second == []:
+                continue
+            to_split = [first[0], second[0]]
+
+        new_conn = []
+        for edge_num, length in to_split:
+            arg, at_start = edges[edge_num]
+            toks = relation[arg]["TokenList"]
+            tok_new, conn_toks = _split_edge(toks, length, at_start)
+            relation[arg]["TokenList"] = tok_new
+            new_conn += conn_toks
+        relation["Connective"]["TokenList"] = new_conn
+        relation["Type"] = "Explicit"
+        return relation
     return relation
 
 
-def trans_explicit(relation, dimlex_connectives, text):
+def trans_explicit(relation, connective_index, text):
     """
     Check if translated explicit relation has become implicit.
 
@@ -347,28 +589,196 @@ def trans_explicit(relation, dimlex_connectives, text):
     ----------
     relation : dict
         Relation from output of replace_inds.
-    dimlex_connectives : dict
-        DimLex connectives with senses.
+    connective_index : dict
+        Index of DimLex connectives, as returned by build_connective_index.
     text : [str]
         Text of for which the relation has been found.
     """
     curr_connective = relation["Connective"]["TokenList"]
-    curr_connective = [text[i].lower() for i in curr_connective]
-    found = False
-    for connective in dimlex_connectives:
-        connective = [part.split() for part in connective]
-        connective = [word for part in connective for word in part]
-        if connective == curr_connective:
-            found = True
-            break
-    if not found:
+    curr_connective = tuple(text[i].lower() for i in curr_connective)
+    if not curr_connective in connective_index["surface"]:
         relation["Type"] = "Implicit"
         relation["Connective"]["TokenList"] = []
     relation["orig_type"] = "Explicit"
     return relation
 
 
-def transfer_rels(relations_dir, align_dir, txt_dir, out_dir, dimlex_path):
+def transfer_relations(relations, alignments, text, connective_index):
+    """
+    Transfer the relations of one document to German text.
+
+    Parameters
+    ----------
+    relations : [dict]
+        List of relations found for the document.
+    alignments : (numpy.ndarray, numpy.ndarray)
+        Alignments as returned by read_alignments.
+    text : [str]
+        Tokens of the German text.
+    connective_index : dict
+        Index of DimLex connectives, as returned by load_dimlex.
+
+    Return
+    ------
+    trans_relations : [dict]
+        Transferred relations.
+    """
+
+    relations = project_relations(relations, alignments)
+
+    trans_relations = []
+    for relation in relations:
+        if relation["Type"] == "Explicit":
+            relation = trans_explicit(relation, connective_index, text)
+        else:
+            relation = trans_implicit(relation, connective_index, text)
+
+        tok_list1 = relation["Arg1"]["TokenList"]
+        tok_list2 = relation["Arg2"]["TokenList"]
+        if tok_list1 == [] or tok_list2 == []:
+            continue
+        trans_relations.append(relation)
+
+    return trans_relations
+
+
+def transfer_file(fn, sources, txt_dir, connective_index):
+    """
+    Transfer the relations of one document from one or more
+    source languages to German text. The German text is read only once.
+    Sources without relations or alignments for the document are skipped.
+
+    Parameters
+    ----------
+    fn : str
+        Filename of the document.
+    sources : [(str, str, str)]
+        For each source language, the directories containing
+        the parsed relations, the alignments, and the directory
+        to save the transferred relations to.
+    txt_dir : str
+        Directory containing German text.
+    connective_index : dict
+        Index of DimLex connectives, as returned by load_dimlex.
+    """
+
+    text = None
+    for relations_dir, align_dir, out_dir in sources:
+        parsed_path = os.path.join(relations_dir, fn)
+        align_path = os.path.join(align_dir, fn+".txt")
+        if not os.path.exists(parsed_path) or not os.path.exists(align_path):
+            continue
+        relations = read_relations(parsed_path)
+        alignments = read_alignments(align_path)
+
+        if text is None:
+            txt_path = os.path.join(txt_dir, fn+".txt")
+            text = read_txt(txt_path)
+
+        trans_relations = transfer_relations(relations, alignments, text,
+                                             connective_index)
+
+        out_path = os.path.join(out_dir, fn)
+        with open(out_path, "w") as out_file:
+            for rel in trans_relations:
+                json.dump(rel,out_file,ensure_ascii=False)
+                out_file.write("\n")
+
+
+# connective index of a worker process, set by _init_worker
+_worker_index = None
+
+
+def _init_worker(connective_index):
+    """
+    Make the connective index available to a worker process.
+    """
+    global _worker_index
+    _worker_index = connective_index
+
+
+def _transfer_file_worker(fn, sources, txt_dir):
+    """
+    Call transfer_file in a worker process.
+    """
+    transfer_file(fn, sources, txt_dir, _worker_index)
+
+
+def _run_transfer(fns, sources, txt_dir, connective_index, workers):
+    """
+    Call transfer_file for each document, sequentially or in worker processes.
+    """
+    if workers == 1:
+        for fn in tqdm(fns):
+            transfer_file(fn, sources, txt_dir, connective_index)
+        return
+
+    def doc_size(fn):
+        paths = [os.path.join(relations_dir, fn) for relations_dir, _, _ in sources]
+        return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+    # start with the largest documents, so that no worker
+    # is left with a long document at the end
+    fns = sorted(fns, key=doc_size, reverse=True)
+    worker_fn = functools.partial(_transfer_file_worker, sources=sources,
+                                  txt_dir=txt_dir)
+    for _ in imap_files(worker_fn, fns, workers, initializer=_init_worker,
+                        initargs=(connective_index,)):
+        pass
+
+
+def _fingerprint(path):
+    """
+    Return size and modification time of a file,
+    or None if it doesn't exist.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _plan_incremental(fns, relations_dir, align_dir, txt_dir, out_dir,
+                      manifest, dimlex_hash):
+    """
+    Find the documents whose inputs changed since they were last transferred.
+    Remove outputs of documents whose relations, alignments or text disappeared.
+    Return the documents to transfer and the fingerprints of their inputs.
+    """
+    fingerprints = dict()
+    for fn in fns:
+        fingerprints[fn] = {
+            "relations": _fingerprint(os.path.join(relations_dir, fn)),
+            "alignments": _fingerprint(os.path.join(align_dir, fn+".txt")),
+            "text": _fingerprint(os.path.join(txt_dir, fn+".txt")),
+            "dimlex": dimlex_hash,
+            # a manifest reused for another output directory doesn't apply
+            "out_dir": os.path.abspath(out_dir)}
+
+    def missing_inputs(fn):
+        return fn not in fingerprints or fingerprints[fn]["alignments"] is None \
+            or fingerprints[fn]["text"] is None
+
+    for fn in list(manifest.keys()):
+        if missing_inputs(fn):
+            out_path = os.path.join(out_dir, fn)
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            del manifest[fn]
+
+    to_transfer = []
+    for fn in fns:
+        if missing_inputs(fn):
+            continue
+        if manifest.get(fn) == fingerprints[fn] and \
+                os.path.exists(os.path.join(out_dir, fn)):
+            continue
+        to_transfer.append(fn)
+    return to_transfer, fingerprints
+
+
+def transfer_rels(relations_dir, align_dir, txt_dir, out_dir, dimlex_path,
+                  workers=1, manifest_path=None, cache_dir=None):
     """
     Transfer relations for one language to German text.
 
@@ -384,55 +794,72 @@ def transfer_rels(relations_dir, align_dir, txt_dir, out_dir, dimlex_path):
         Directory to save transferred relations to.
     dimlex_path : str
         File containing dimlex dataset.
+    workers : int
+        Number of processes to use. The lexicon is loaded once
+        and shared with the forked worker processes.
+    manifest_path : str or None
+        If given, only transfer documents whose relations, alignments,
+        text, or DiMLex changed since the last run. The manifest file
+        records size and modification time of the inputs of each output,
+        and the output directory.
+        It shouldn't be placed inside out_dir.
+    cache_dir : str or None
+        Directory to keep the compiled DiMLex in, see load_dimlex.
     """
 
-    dimlex_connectives = read_dimlex(dimlex_path)
+    connective_index = load_dimlex(dimlex_path, cache_dir=cache_dir)
+    fns = os.listdir(relations_dir)
 
-    for fn in tqdm(os.listdir(relations_dir)):
-        parsed_path = os.path.join(relations_dir, fn)
-        relations = read_relations(parsed_path)
+    if manifest_path is not None:
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        else:
+            manifest = dict()
+        fns, fingerprints = _plan_incremental(fns, relations_dir, align_dir,
+                txt_dir, out_dir, manifest, connective_index["hash"])
 
-        align_path = os.path.join(align_dir, fn+".txt")
-        if not os.path.exists(align_path):
-            continue
-        relations = replace_inds(relations, align_path)
-
-        txt_path = os.path.join(txt_dir, fn+".txt")
-        text = read_txt(txt_path)
-
-        trans_relations = []
-        for i, relation in enumerate(relations):
-            #make relation arguments contiguous
-            tok_list1 = relation["Arg1"]["TokenList"]
-            if len(tok_list1) > 0:
-                tok_min = min(tok_list1)
-                tok_max = max(tok_list1)
-                tok_list1 = list(range(tok_min,tok_max+1))
-                relation["Arg1"]["TokenList"] = tok_list1
-
-            tok_list2 = relation["Arg2"]["TokenList"]
-            if len(tok_list2) > 0:
-                tok_min = min(tok_list2)
-                tok_max = max(tok_list2)
-                tok_list2 = list(range(tok_min,tok_max+1))
-                relation["Arg2"]["TokenList"] = tok_list2
-
-            if relation["Type"] == "Explicit":
-                relation = trans_explicit(relation, dimlex_connectives, text)
-            else:
-                relation = trans_implicit(relation, dimlex_connectives, text)
+    sources = [(relations_dir, align_dir, out_dir)]
+    _run_transfer(fns, sources, txt_dir, connective_index, workers)
 
-            tok_list1 = relation["Arg1"]["TokenList"]
-            tok_list2 = relation["Arg2"]["TokenList"]
-            if tok_list1 == [] or tok_list2 == []:
-                continue
-            trans_relations.append(relation)
-        
-        out_path = os.path.join(out_dir, fn)
-        with open(out_path, "w") as out_file:
-            for rel in trans_relations:
-                json.dump(rel,out_file,ensure_ascii=False)
-                out_file.write("\n")
+    if manifest_path is not None:
+        for fn in fns:
+            manifest[fn] = fingerprints[fn]
+        tmp_path = manifest_path + "." + str(os.getpid())
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_path, manifest_path)
+
+
+def transfer_rels_multi(sources, txt_dir, dimlex_path, workers=1, cache_dir=None):
+    """
+    Transfer relations for several languages to German text in one pass.
+    Each German document and the lexicon are only read once.
+
+    Parameters
+    ----------
+    sources : [(str, str, str)]
+        For each source language, the directories containing
+        the parsed relations, the alignments, and the directory
+        to save the transferred relations to.
+    txt_dir : str
+        Directory containing German text.
+    dimlex_path : str
+        File containing dimlex dataset.
+    workers : int
+        Number of processes to use.
+    cache_dir : str or None
+        Directory to keep the compiled DiMLex in, see load_dimlex.
+    """
+
+    connective_index = load_dimlex(dimlex_path, cache_dir=cache_dir)
+
+    fns = set()
+    for relations_dir, _, _ in sources:
+        fns.update(os.listdir(relations_dir))
+    fns = sorted(fns)
+
+    _run_transfer(fns, sources, txt_dir, connective_index, workers)
 
 
 simple_drop_probs = {"Comparison.Contrast": 0.5,
@@ -441,12 +868,63 @@ simple_drop_probs = {"Comparison.Contrast": 0.5,
                      "Expansion.Restatement": 2/3}
 
 
-def sample_relations(orig_dir, new_dir, drop_probs, seed=28):
+def _sample_value(seed, doc_id, rel_id):
+    """
+    Return a number in [0, 1) derived from the seed and the relation.
+    Unlike random.random(), it doesn't depend on the order
+    in which the relations are processed.
+    """
+    key = "{}:{}:{}".format(seed, doc_id, rel_id).encode("utf-8")
+    digest = hashlib.sha1(key).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def _sense_level(sense, level):
+    """
+    Cut a sense down to its first levels. Keep it whole, if level is None.
+    """
+    if level is None:
+        return sense
+    return ".".join(sense.split(".")[:level])
+
+
+def _sample_file(fn, orig_dir, new_dir, drop_probs, seed, level):
+    """
+    Sample the relations of one document for sample_relations.
+    """
+    to_transfer = []
+    with open(os.path.join(orig_dir, fn)) as relsf:
+        for line in relsf:
+            rel = json.loads(line)
+            sense = _sense_level(rel["Sense"][0], level)
+            if sense in drop_probs:
+                drop_num = _sample_value(seed, fn, rel["ID"])
+                if drop_num < drop_probs[sense]:
+                    drop = True
+                else:
+                    drop = False
+            else:
+                drop = False
+            if not drop:
+                to_transfer.append(rel)
+
+    with open(os.path.join(new_dir, fn), "w") as newf:
+        for rel in to_transfer:
+            json.dump(rel, newf)
+            newf.write("\n")
+
+
+def sample_relations(orig_dir, new_dir, drop_probs, seed=28, workers=1,
+                     level=None):
     """
     Take directory of relations and sample out
     some of the relations that occur more often
     in our corpus than in the PCC.
 
+    Whether a relation is dropped only depends on the seed,
+    the document name and the relation ID. The result is therefore
+    the same for any order of the files and any number of workers.
+
     Parameters
     ----------
     orig_dir : str
@@ -459,62 +937,231 @@ def sample_relations(orig_dir, new_dir, drop_probs, seed=28):
         Senses not contained in the dictionary aren't dropped.
     seed : int
         Random seed to use.
+    workers : int
+        Number of processes to use.
+    level : int or None
+        If given, the senses in drop_probs only have this many levels
+        and the senses of the relations are cut down accordingly.
     """
 
-    random.seed(seed)
     if not os.path.exists(new_dir):
         os.makedirs(new_dir)
 
-    for fn in tqdm(os.listdir(orig_dir)):
-        to_transfer = []
-        with open(os.path.join(orig_dir, fn)) as relsf:
+    sample_fn = functools.partial(_sample_file, orig_dir=orig_dir, new_dir=new_dir,
+                                  drop_probs=drop_probs, seed=seed, level=level)
+    process_files(sample_fn, os.listdir(orig_dir), workers)
+
+
+def count_senses(rel_dir, level=None):
+    """
+    Count how often each sense occurs in a directory of relations.
+
+    Parameters
+    ----------
+    rel_dir : str
+        Directory containing relations.
+    level : int or None
+        Number of sense levels to count. None for whole senses.
+
+    Return
+    ------
+    sense_counts : dict
+        Number of relations for each sense.
+    """
+
+    sense_counts = dict()
+    for fn in tqdm(os.listdir(rel_dir)):
+        with open(os.path.join(rel_dir, fn)) as relsf:
             for line in relsf:
                 rel = json.loads(line)
-                sense = rel["Sense"][0]
-                if sense in drop_probs:
-                    drop_num = random.random()
-                    if drop_num < drop_probs[sense]:
-                        drop = True
-                    else:
-                        drop = False
-                else:
-                    drop = False
-                if not drop:
-                    to_transfer.append(rel)
-
-        with open(os.path.join(new_dir, fn), "w") as newf:
-            for rel in to_transfer:
-                json.dump(rel, newf)
-                newf.write("\n")
-
-
-def _single_sent(i_inds, e_inds, sent_inds):
-    """
-    Return true, if each argument of the relation
-    is contained in one sentence each.
-    Also count as true, if the last word of the argument is
-    in the next sentence.
-    """
-    for j, curr_sent in enumerate(sent_inds):
-        comb = [i for i in i_inds if i in curr_sent]
-        overhang = [i for i in i_inds if i not in curr_sent]
-        if len(comb) > 0 and len(overhang) < 2:
-            if j < len(sent_inds) - 1:
-                next_sent = sent_inds[j+1]
-                comb2 = [i for i in e_inds if i in next_sent]
-                overhang2 = [i for i in e_inds if i not in next_sent]
-                if len(comb2) > 0 and len(overhang) < 2:
-                    return True
-            if j > 0:
-                prev_sent = sent_inds[j-1]
-                comb2 = [i for i in e_inds if i in prev_sent]
-                overhang2 = [i for i in e_inds if i not in prev_sent]
-                if len(comb2) > 0 and len(overhang) < 2:
-                    return True
-    return False
+                sense = _sense_level(rel["Sense"][0], level)
+                sense_counts[sense] = sense_counts.get(sense, 0) + 1
+    return sense_counts
+
+
+# PDTB3 senses of the PCC, that pdtb3_to_conll collapses to the first level,
+# with their closest CoNLL-2015 sense
+PCC_CONLL_SENSES = {
+    "Expansion.Level-of-detail": "Expansion.Restatement",
+    "Expansion.Equivalence": "Expansion.Restatement",
+    "Expansion.Substitution": "Expansion.Alternative.Chosen alternative",
+    "Expansion.Disjunction": "Expansion.Alternative",
+    "Contingency.Negative-condition": "Contingency.Condition",
+    "Contingency.Purpose": "Contingency.Cause.Result",
+}
+
 
+def pcc_to_conll_sense(sense):
+    """
+    Translate a PDTB3 sense from the PCC into the CoNLL-2015 sense
+    the parsers would have assigned, keeping the second level
+    where pdtb3_to_conll drops it.
+
+    Parameters
+    ----------
+    sense : str
+        PDTB3 sense.
 
-def sample_relations_impl_sents(orig_dir, txt_dir, new_dir):
+    Return
+    ------
+    sense_conll : str
+        CoNLL-2015 sense.
+    """
+    levels = sense.split(".")
+    if levels[-1].startswith("Arg"):
+        levels = levels[:-1]
+    # e.g. Contingency.Cause+Belief.Reason+Belief
+    levels = [l.replace("+Belief", "").replace("+SpeechAct", "") for l in levels]
+    sense = ".".join(levels)
+    if sense in PCC_CONLL_SENSES:
+        return PCC_CONLL_SENSES[sense]
+    return pdtb3_to_conll(sense)
+
+
+def count_pcc_senses(pcc_dir, level=None):
+    """
+    Count how often each sense occurs in the PCC.
+    The PDTB3 senses are translated to CoNLL-2015 senses first,
+    see pcc_to_conll_sense.
+
+    Parameters
+    ----------
+    pcc_dir : str
+        Directory containing PCC connectives xml files.
+    level : int or None
+        Number of sense levels to count. None for whole senses.
+
+    Return
+    ------
+    sense_counts : dict
+        Number of relations for each sense.
+    """
+
+    sense_counts = dict()
+    for fn in os.listdir(pcc_dir):
+        tree = ET.parse(os.path.join(pcc_dir, fn))
+        for relation in tree.iter("relation"):
+            if "pdtb3_sense" in relation.attrib:
+                sense = pcc_to_conll_sense(relation.attrib["pdtb3_sense"])
+            else:
+                sense = relation.attrib["type"] # EntRel or NoRel
+            sense = _sense_level(sense, level)
+            sense_counts[sense] = sense_counts.get(sense, 0) + 1
+    return sense_counts
+
+
+def target_drop_probs(sense_counts, target_counts, warn_unmatched=0.05):
+    """
+    Compute drop probabilities that turn one sense distribution into another.
+    Relations of the sense that is most underrepresented compared to
+    the target are all kept, the others are dropped as far as needed.
+    Senses that occur in only one of the two distributions aren't dropped
+    and aren't considered for the distributions.
+    A warning is printed, if they make up a large part of either corpus.
+
+    Parameters
+    ----------
+    sense_counts : dict
+        Sense counts of the corpus to sample from.
+    target_counts : dict
+        Sense counts of the target distribution.
+    warn_unmatched : float
+        Fraction of relations with senses missing in the other corpus,
+        above which to warn.
+
+    Return
+    ------
+    drop_probs : dict
+        Probability for each sense, that a relation is dropped.
+    """
+
+    senses = [s for s in sense_counts if s in target_counts]
+    for name, counts, other in [("corpus", sense_counts, target_counts),
+                                ("target", target_counts, sense_counts)]:
+        all_rels = sum(counts.values())
+        unmatched = dict((s, c) for s, c in counts.items() if s not in other)
+        if all_rels > 0 and sum(unmatched.values()) / all_rels > warn_unmatched:
+            frac = sum(unmatched.values()) / all_rels
+            print("Warning: {:.1%} of the {} relations have senses ".format(frac, name)
+                  + "that don't occur in the other corpus: "
+                  + ", ".join(sorted(unmatched)))
+    total = sum(sense_counts[s] for s in senses)
+    target_total = sum(target_counts[s] for s in senses)
+    if total == 0 or target_total == 0:
+        return dict()
+
+    ratios = dict()
+    for sense in senses:
+        frac = sense_counts[sense] / total
+        target_frac = target_counts[sense] / target_total
+        ratios[sense] = target_frac / frac
+    max_ratio = max(ratios.values())
+
+    drop_probs = dict()
+    for sense in senses:
+        drop_probs[sense] = 1 - ratios[sense] / max_ratio
+    return drop_probs
+
+
+def sample_to_pcc(orig_dir, new_dir, pcc_dir, level=2, seed=28, workers=1):
+    """
+    Sample relations so that their sense distribution matches the PCC.
+    The first pass counts the senses in both corpora,
+    the second pass drops relations with the resulting probabilities.
+
+    Parameters
+    ----------
+    orig_dir : str
+        Directory containing the original relations.
+    new_dir : str
+        Directory to save new relations to.
+    pcc_dir : str
+        Directory containing PCC connectives xml files.
+    level : int or None
+        Number of sense levels at which to match the distributions.
+    seed : int
+        Random seed to use.
+    workers : int
+        Number of processes to use.
+
+    Return
+    ------
+    drop_probs : dict
+        The drop probabilities that were used.
+    """
+
+    sense_counts = count_senses(orig_dir, level=level)
+    target_counts = count_pcc_senses(pcc_dir, level=level)
+    drop_probs = target_drop_probs(sense_counts, target_counts)
+    sample_relations(orig_dir, new_dir, drop_probs, seed=seed,
+                     workers=workers, level=level)
+    return drop_probs
+
+
+def _sample_impl_sents_file(fn, orig_dir, txt_dir, new_dir, cache_dir):
+    """
+    Sample the relations of one document for sample_relations_impl_sents.
+    """
+    txt_path = os.path.join(txt_dir, fn.split(".")[0] + ".txt")
+    starts = read_sentence_starts(txt_path, cache_dir=cache_dir)
+
+    to_transfer = []
+    with open(os.path.join(orig_dir, fn)) as relsf:
+        for line in relsf:
+            relation = json.loads(line)
+            i_inds = relation["Arg1"]["TokenList"]
+            e_inds = relation["Arg2"]["TokenList"]
+            if single_sent(i_inds, e_inds, starts):
+                to_transfer.append(relation)
+
+    with open(os.path.join(new_dir, fn), "w") as newf:
+        for rel in to_transfer:
+            json.dump(rel, newf)
+            newf.write("\n")
+
+
+def sample_relations_impl_sents(orig_dir, txt_dir, new_dir, workers=1,
+                                cache_dir=None):
     """
     Take directory of relations and sample out
     implicit relations that do not span between two sentences.
@@ -527,33 +1174,16 @@ def sample_relations_impl_sents(orig_dir, txt_dir, new_dir):
         Directory containing German text.
     new_dir : str
         Directory to save new relations to.
+    workers : int
+        Number of processes to use.
+    cache_dir : str or None
+        Directory to cache sentence boundaries in.
     """
 
     if not os.path.exists(new_dir):
         os.makedirs(new_dir)
 
-    for fn in tqdm(os.listdir(orig_dir)):
-        txt_path = os.path.join(txt_dir, fn.split(".")[0] + ".txt")
-        with open(txt_path) as txt_file:
-            lines = txt_file.readlines()
-            sents = [line.split() for line in lines]
-            sent_inds = []
-            word_count = 0
-            for sent in sents:
-                inds = set([i + word_count for i in range(len(sent))])
-                sent_inds.append(inds)
-                word_count += len(sent)
-
-        to_transfer = []
-        with open(os.path.join(orig_dir, fn)) as relsf:
-            for line in relsf:
-                relation = json.loads(line)
-                i_inds = relation["Arg1"]["TokenList"]
-                e_inds = relation["Arg2"]["TokenList"]
-                if _single_sent(i_inds, e_inds, sent_inds):
-                    to_transfer.append(relation)
-
-        with open(os.path.join(new_dir, fn), "w") as newf:
-            for rel in to_transfer:
-                json.dump(rel, newf)
-                newf.write("\n")
+    sample_fn = functools.partial(_sample_impl_sents_file, orig_dir=orig_dir,
+                                  txt_dir=txt_dir, new_dir=new_dir,
+                                  cache_dir=cache_dir)
+    process_files(sample_fn, os.listdir(orig_dir), workers)
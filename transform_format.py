@@ -1,14 +1,114 @@
 import os
+import io
 import json
+import functools
+import itertools
+import multiprocessing as mp
+import numpy as np
 from lxml import etree
 import benepar
 from tqdm import tqdm
 import html
 from nltk.tree import Tree, ParentedTree
+from parallel import process_files
+from cache import hash_cached
 import pickle
 
 
-def trans_arg(arg, tok_tups):
+# tokens that are attached to the previous token without whitespace
+NO_SPACE_BEFORE = [",",")",".",";",":","?","!"]
+
+
+def token_table(lines):
+    """
+    Compute character offsets and sentence numbers for all tokens of a text,
+    assuming the text is written with whitespace between tokens,
+    except before punctuation and after opening parentheses.
+
+    Parameters
+    ----------
+    lines : [str]
+        Lines of a word-tokenized text with one sentence per line.
+
+    Return
+    ------
+    table : dict
+        "char_start", "char_end" and "sent_id" of each token
+        as numpy arrays, and the "tokens" themselves.
+    """
+
+    tokens = []
+    sent_ids = []
+    spaces = []
+    for i, line in enumerate(lines):
+        curr_toks = line.split()
+        tokens += curr_toks
+        sent_ids += [i] * len(curr_toks)
+        spaces += [j == 0 or not tok in NO_SPACE_BEFORE for j, tok in enumerate(curr_toks)]
+
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    # since the tokenization left whitespaces behind (
+    parens = np.array([tok == "(" for tok in tokens], dtype=np.int64)
+    spaces = np.array(spaces, dtype=np.int64)
+
+    advance = lengths + parens
+    char_start = np.cumsum(spaces) + np.cumsum(advance) - advance - 1
+    table = {
+        "char_start": char_start,
+        "char_end": char_start + lengths,
+        "sent_id": np.array(sent_ids, dtype=np.int64),
+        "tokens": tokens,
+    }
+    return table
+
+
+def _save_token_table(table_file, table):
+    """
+    Write a token table to an open binary file as npz.
+    """
+    np.savez(table_file, char_start=table["char_start"],
+             char_end=table["char_end"], sent_id=table["sent_id"],
+             tokens=np.array(table["tokens"], dtype=str))
+
+
+def _load_token_table(table_path):
+    """
+    Read a token table written by _save_token_table.
+    """
+    with np.load(table_path) as npz:
+        table = dict((key, npz[key]) for key in npz.files)
+    table["tokens"] = table["tokens"].tolist()
+    return table
+
+
+def read_token_table(txt_path, cache_dir=None):
+    """
+    Read the token table of a text file, see token_table.
+    With a cache directory, the table is saved there under the SHA-1
+    of the text, so that it is only computed once.
+
+    Parameters
+    ----------
+    txt_path : str
+        Path to word-tokenized txt file with one sentence per line.
+    cache_dir : str or None
+        Directory to keep token tables in.
+
+    Return
+    ------
+    table : dict
+        Token table of the text.
+    """
+
+    with open(txt_path, "rb") as txt_file:
+        data = txt_file.read()
+    lines = io.StringIO(data.decode("utf-8"), newline=None)
+
+    return hash_cached(data, cache_dir, ".toks.npz", lambda: token_table(lines),
+                       _save_token_table, _load_token_table)
+
+
+def trans_arg(arg, tok_table):
     """
     Transfer relation argument from conll output format to input format.
 
@@ -16,104 +116,71 @@ def trans_arg(arg, tok_tups):
     ----------
     arg : dict()
         Argument.
-    toks_tups : [[]]
-        List of tokens in text.
+    tok_table : dict
+        Token table of the text, see token_table.
     """
 
     new_arg = dict()
 
     #generate token list
-    tok_list = arg["TokenList"]
-    new_tok_list = []
-    for i, tok_ind in enumerate(tok_list):
-        char_start, char_end, sent_num, _ = tok_tups[tok_ind]
-        # format for each token:
-        # [ind of first character, ind of first character after token,
-        #  token index in text, index of sentence, index of token in arg["TokenList"]]
-        new_tok = [char_start, char_end, tok_ind, sent_num, i]
-        new_tok_list.append(new_tok)
-
-    new_arg["TokenList"] = new_tok_list
-
-    #generate CharacterSpanList
-    split_lists = []
-    curr_list = []
-    for tok_tup in new_tok_list:
-        if curr_list == []:
-            curr_list.append(tok_tup)
-        elif curr_list[-1][2] == tok_tup[2] - 1:
-            curr_list.append(tok_tup)
-        else:
-            split_lists.append(curr_list)
-            curr_list = [tok_tup]
-    if curr_list != []:
-        split_lists.append(curr_list)
-
-    char_spans = []
-    for tok_list in split_lists:
-        char_span = [tok_list[0][0], tok_list[-1][1]]
-        char_spans.append(char_span)
-
-    new_arg["CharacterSpanList"] = char_spans
+    inds = np.asarray(arg["TokenList"], dtype=np.int64)
+    char_start = tok_table["char_start"][inds]
+    char_end = tok_table["char_end"][inds]
+    # format for each token:
+    # [ind of first character, ind of first character after token,
+    #  token index in text, index of sentence, index of token in arg["TokenList"]]
+    new_tok_list = np.column_stack([char_start, char_end, inds,
+                                    tok_table["sent_id"][inds],
+                                    np.arange(len(inds))])
+    new_arg["TokenList"] = new_tok_list.tolist()
+
+    #generate CharacterSpanList, one span per run of consecutive tokens
+    breaks = np.diff(inds) != 1
+    span_start = np.ones(len(inds), dtype=bool)
+    span_start[1:] = breaks
+    span_end = np.ones(len(inds), dtype=bool)
+    span_end[:-1] = breaks
+    char_spans = np.column_stack([char_start[span_start], char_end[span_end]])
+    new_arg["CharacterSpanList"] = char_spans.tolist()
 
     #generate raw text
-    word_inds = [tok_tup[2] for tok_tup in new_tok_list]
-    words = [tok_tups[i][3] for i in word_inds]
-    raw_text = ""
-    for word in words:
-        if word in [",",")",".",";",":","?","!"] or \
-                raw_text == "" or \
-                raw_text[-1] == "(":
-            raw_text += word
-        else:
-            raw_text += " " + word
+    words = [tok_table["tokens"][i] for i in inds.tolist()]
+    raw_text = []
+    for i, word in enumerate(words):
+        if i > 0 and not word in NO_SPACE_BEFORE and not words[i-1].endswith("("):
+            raw_text.append(" ")
+        raw_text.append(word)
 
-    new_arg["RawText"] = raw_text
+    new_arg["RawText"] = "".join(raw_text)
 
     return new_arg
 
 
-def transfer_to_conll(parsed_path, txt_path, out_path):
+def _iter_parsed(parsed_path):
     """
-    Take a file containing translated relations and
-    transfer it to the data format of the CoNLL 2015 shared task.
+    Read the relations of one document one by one.
+    """
+    with open(parsed_path) as parsed_file:
+        for line in parsed_file:
+            yield json.loads(line)
 
-    Parameters
-    ----------
-    parsed_path : str
-        Path to file containing the transferred relations.
-    txt_path : str
-        Path to word-tokenized txt file with one sentence per line.
-    out_path : str
-        Path to save resulting file to.
+
+def _read_parsed(parsed_path):
     """
+    Read the relations of one document.
+    """
+    return list(_iter_parsed(parsed_path))
 
-    char_count, tok_count, sent_count = -2,0,0
-    toks = []
 
-    with open(txt_path) as txt_file:
-        for i, line in enumerate(txt_file):
-            curr_toks = line.split()
-            for j,tok in enumerate(curr_toks):
-                if not tok in [",",")",".",";",":","?","!"] or j==0:
-                    #count whitespaces and linebreaks
-                    char_count += 1
-                char_start = char_count + 1
-                char_end = char_start + len(tok)
-                sent_num = i
-                toks.append([char_start, char_end, sent_num, tok])
-                char_count += len(tok)
-                if tok == "(":
-                    #since the tokenization left whitespaces behind (
-                    char_count += 1
-
-    rels = []
-    with open(parsed_path) as parsed_file:
-        fn = parsed_path.split("/")[-1]
-        for i, line in enumerate(parsed_file):
-            rel = json.loads(line)
+def _write_conll(rels, toks, doc_id, out_path):
+    """
+    Write the relations of a document in the CoNLL 2015 format.
+    """
+
+    with open(out_path, "w") as out_file:
+        for i, rel in enumerate(rels):
             new_rel = dict()
-            new_rel["DocID"] = fn
+            new_rel["DocID"] = doc_id
             new_rel["ID"] = i
             new_rel["Sense"] = rel["Sense"]
             new_rel["Type"] = rel["Type"]
@@ -121,15 +188,162 @@ def transfer_to_conll(parsed_path, txt_path, out_path):
             new_rel["Arg2"] = trans_arg(rel["Arg2"], toks)
             new_rel["Connective"] = trans_arg(rel["Connective"], toks)
 
-            rels.append(new_rel)
+            json.dump(new_rel,out_file)
+            out_file.write("\n")
+
+
+def _pcc_relation(rel, toks):
+    """
+    Build the xml element of one relation in the format of the PCC.
+    """
+
+    rel_id = rel["ID"]
+    rel_type = rel["Type"].lower()
+    rel_sense = rel["Sense"][0]
+    new_rel = etree.Element("relation", 
+        relation_id=str(rel_id), type=rel_type, pdtb3_sense=rel_sense)
+
+    conn = rel["Connective"]["TokenList"]
+    conn_toks = [(i, toks[i]) for i in conn]
+    connective_tokens = etree.SubElement(new_rel, "connective_tokens")
+    for ind, tok in conn_toks:
+        etree.SubElement(connective_tokens, "connective_token", 
+                id=str(ind), token=tok)
+    
+    arg1 = rel["Arg1"]["TokenList"]
+    arg2 = rel["Arg2"]["TokenList"]
+    # the PCC differentiates between internal and external arguments
+    if len(conn) == 0:
+        one_internal = True
+    elif len(arg2) == 0:
+        one_internal = True
+    elif len(arg1) == 0:
+        one_internal = False
+    elif max(conn) >= min(arg2) and min(conn) > max(arg1):
+        # if parts of the connective are in argument 2
+        # and none in argument 1
+        # we consider it to be the internal argument
+        one_internal = False
+    else:
+        one_internal = True
+    
+    if one_internal:
+        int_arg_tokens = etree.SubElement(new_rel, "int_arg_tokens")
+        for tok_ind in arg1:
+            tok = toks[tok_ind]
+            etree.SubElement(int_arg_tokens, "int_arg_token",
+                    id=str(tok_ind), token=tok)
+        ext_arg_tokens = etree.SubElement(new_rel, "ext_arg_tokens")
+        for tok_ind in arg2:
+            tok = toks[tok_ind]
+            etree.SubElement(ext_arg_tokens, "ext_arg_token",
+                    id=str(tok_ind), token=tok)
+    else:
+        ext_arg_tokens = etree.SubElement(new_rel, "ext_arg_tokens")
+        for tok_ind in arg1:
+            tok = toks[tok_ind]
+            etree.SubElement(ext_arg_tokens, "ext_arg_token",
+                    id=str(tok_ind), token=tok)
+        int_arg_tokens = etree.SubElement(new_rel, "int_arg_tokens")
+        for tok_ind in arg2:
+            tok = toks[tok_ind]
+            etree.SubElement(int_arg_tokens, "int_arg_token",
+                    id=str(tok_ind), token=tok)
+
+    return new_rel
+
+
+def _write_pcc(rels, toks, out_path, streaming=False):
+    """
+    Write the relations of a document in the format of the PCC.
+    With streaming, tokens and relations are written one by one
+    instead of building the whole tree first, and rels may be
+    an iterator. The output is the same.
+    """
+
+    if not streaming:
+        discourse = etree.Element("discourse")
+        tokens = etree.SubElement(discourse, "tokens")
+        for i, tok in enumerate(toks):
+            etree.SubElement(tokens, "token", id=str(i)).text = tok
+
+        relations = etree.SubElement(discourse, "relations")
+        for rel in rels:
+            relations.append(_pcc_relation(rel, toks))
+
+        tree = etree.ElementTree(discourse)
+        tree.write(out_path, encoding="UTF-8", 
+                xml_declaration=True, pretty_print=True)
+        return
+
+    # indent the way pretty_print does
+    with open(out_path, "wb") as out_file:
+        with etree.xmlfile(out_file, encoding="UTF-8") as xf:
+            xf.write_declaration()
+            with xf.element("discourse"):
+                xf.write("\n  ")
+                if len(toks) == 0:
+                    xf.write(etree.Element("tokens"))
+                else:
+                    with xf.element("tokens"):
+                        for i, tok in enumerate(toks):
+                            token = etree.Element("token", id=str(i))
+                            token.text = tok
+                            xf.write("\n    ")
+                            xf.write(token)
+                        xf.write("\n  ")
+                xf.write("\n  ")
+                rels = iter(rels)
+                first_rel = next(rels, None)
+                if first_rel is None:
+                    xf.write(etree.Element("relations"))
+                else:
+                    with xf.element("relations"):
+                        for rel in itertools.chain([first_rel], rels):
+                            new_rel = _pcc_relation(rel, toks)
+                            etree.indent(new_rel, space="  ", level=2)
+                            xf.write("\n    ")
+                            xf.write(new_rel)
+                        xf.write("\n  ")
+                xf.write("\n")
+        out_file.write(b"\n")
+
+
+def _write_jsonl(rels, out_path):
+    """
+    Write the relations of a document in the format used
+    by transfer_rels, one json object per line.
+    """
 
     with open(out_path, "w") as out_file:
         for rel in rels:
-            json.dump(rel,out_file)
+            json.dump(rel,out_file,ensure_ascii=False)
             out_file.write("\n")
 
 
-def transfer_to_conll_dir(parsed_dir, txt_dir, out_dir):
+def transfer_to_conll(parsed_path, txt_path, out_path, cache_dir=None):
+    """
+    Take a file containing translated relations and
+    transfer it to the data format of the CoNLL 2015 shared task.
+
+    Parameters
+    ----------
+    parsed_path : str
+        Path to file containing the transferred relations.
+    txt_path : str
+        Path to word-tokenized txt file with one sentence per line.
+    out_path : str
+        Path to save resulting file to.
+    cache_dir : str or None
+        Directory to cache token tables in.
+    """
+
+    toks = read_token_table(txt_path, cache_dir=cache_dir)
+    fn = parsed_path.split("/")[-1]
+    _write_conll(_read_parsed(parsed_path), toks, fn, out_path)
+
+
+def transfer_to_conll_dir(parsed_dir, txt_dir, out_dir, cache_dir=None):
     """
     Wrapper for transfer_to_conll to work over directories.
     """
@@ -144,10 +358,11 @@ def transfer_to_conll_dir(parsed_dir, txt_dir, out_dir):
         txt_path = os.path.join(txt_dir, fn+".txt")
         out_path = os.path.join(out_dir, fn+".json")
 
-        transfer_to_conll(parsed_path, txt_path, out_path)
+        transfer_to_conll(parsed_path, txt_path, out_path, cache_dir=cache_dir)
 
 
-def transfer_to_pcc(parsed_path, txt_path, out_path):
+def transfer_to_pcc(parsed_path, txt_path, out_path, cache_dir=None,
+                    streaming=False):
     """
     Take a file containing translated relations and
     transfer it to the data format of the Potsdam Commentary Corpus.
@@ -160,81 +375,22 @@ def transfer_to_pcc(parsed_path, txt_path, out_path):
         Path to word-tokenized txt file with one sentence per line.
     out_path : str
         Path to save resulting file to.
+    cache_dir : str or None
+        Directory to cache token tables in.
+    streaming : bool
+        Write the xml incrementally instead of building it in memory.
     """
-    
-    toks = []
-
-    for line in open(txt_path):
-        toks += line.split()
-
-    discourse = etree.Element("discourse")
-    tokens = etree.SubElement(discourse, "tokens")
-    for i, tok in enumerate(toks):
-        etree.SubElement(tokens, "token", id=str(i)).text = tok
-
-    relations = etree.SubElement(discourse, "relations")
-    with open(parsed_path) as parsed_f:
-        for line in parsed_f:
-            rel = json.loads(line)
-            rel_id = rel["ID"]
-            rel_type = rel["Type"].lower()
-            rel_sense = rel["Sense"][0]
-            new_rel = etree.SubElement(relations, "relation", 
-                relation_id=str(rel_id), type=rel_type, pdtb3_sense=rel_sense)
-
-            conn = rel["Connective"]["TokenList"]
-            conn_toks = [(i, toks[i]) for i in conn]
-            connective_tokens = etree.SubElement(new_rel, "connective_tokens")
-            for ind, tok in conn_toks:
-                etree.SubElement(connective_tokens, "connective_token", 
-                        id=str(ind), token=tok)
-            
-            arg1 = rel["Arg1"]["TokenList"]
-            arg2 = rel["Arg2"]["TokenList"]
-            # the PCC differentiates between internal and external arguments
-            if len(conn) == 0:
-                one_internal = True
-            elif len(arg2) == 0:
-                one_internal = True
-            elif len(arg1) == 0:
-                one_internal = False
-            elif max(conn) >= min(arg2) and min(conn) > max(arg1):
-                # if parts of the connective are in argument 2
-                # and none in argument 1
-                # we consider it to be the internal argument
-                one_internal = False
-            else:
-                one_internal = True
-            
-            if one_internal:
-                int_arg_tokens = etree.SubElement(new_rel, "int_arg_tokens")
-                for tok_ind in arg1:
-                    tok = toks[tok_ind]
-                    etree.SubElement(int_arg_tokens, "int_arg_token",
-                            id=str(tok_ind), token=tok)
-                ext_arg_tokens = etree.SubElement(new_rel, "ext_arg_tokens")
-                for tok_ind in arg2:
-                    tok = toks[tok_ind]
-                    etree.SubElement(ext_arg_tokens, "ext_arg_token",
-                            id=str(tok_ind), token=tok)
-            else:
-                ext_arg_tokens = etree.SubElement(new_rel, "ext_arg_tokens")
-                for tok_ind in arg1:
-                    tok = toks[tok_ind]
-                    etree.SubElement(ext_arg_tokens, "ext_arg_token",
-                            id=str(tok_ind), token=tok)
-                int_arg_tokens = etree.SubElement(new_rel, "int_arg_tokens")
-                for tok_ind in arg2:
-                    tok = toks[tok_ind]
-                    etree.SubElement(int_arg_tokens, "int_arg_token",
-                            id=str(tok_ind), token=tok)
 
-    tree = etree.ElementTree(discourse)
-    tree.write(out_path, encoding="UTF-8", 
-            xml_declaration=True, pretty_print=True)
+    toks = read_token_table(txt_path, cache_dir=cache_dir)
+    if streaming:
+        rels = _iter_parsed(parsed_path)
+    else:
+        rels = _read_parsed(parsed_path)
+    _write_pcc(rels, toks["tokens"], out_path, streaming=streaming)
 
 
-def transfer_to_pcc_dir(parsed_dir, txt_dir, out_dir):
+def transfer_to_pcc_dir(parsed_dir, txt_dir, out_dir, cache_dir=None,
+                        streaming=False):
     """
     Wrapper for transfer_to_pcc to work over directories.
     """
@@ -248,12 +404,143 @@ def transfer_to_pcc_dir(parsed_dir, txt_dir, out_dir):
         txt_path = os.path.join(txt_dir, fn+".txt")
         out_path = os.path.join(out_dir, fn+".xml")
 
-        transfer_to_pcc(parsed_path, txt_path, out_path)
+        transfer_to_pcc(parsed_path, txt_path, out_path, cache_dir=cache_dir,
+                        streaming=streaming)
+
+
+# file extension of each export format
+EXPORT_FORMATS = {"conll": ".json", "pcc": ".xml", "jsonl": ""}
+
+
+def export_file(fn, parsed_dir, txt_dir, out_dirs, cache_dir=None,
+                streaming=False):
+    """
+    Read the relations and the text of one document
+    and write them in several formats.
+
+    Parameters
+    ----------
+    fn : str
+        Name of the file containing the transferred relations.
+    parsed_dir : str
+        Directory containing the file.
+    txt_dir : str
+        Directory containing word-tokenized txt files.
+    out_dirs : dict
+        Directory to write to for each format in EXPORT_FORMATS.
+    cache_dir : str or None
+        Directory to cache token tables in.
+    streaming : bool
+        Write the PCC xml incrementally instead of building it in memory.
+        The relations are then read again for each format
+        instead of being kept in memory.
+    """
+
+    parsed_path = os.path.join(parsed_dir, fn)
+    if not streaming:
+        rels = _read_parsed(parsed_path)
+    if "conll" in out_dirs or "pcc" in out_dirs:
+        txt_path = os.path.join(txt_dir, fn+".txt")
+        toks = read_token_table(txt_path, cache_dir=cache_dir)
+
+    for out_format, out_dir in out_dirs.items():
+        out_path = os.path.join(out_dir, fn + EXPORT_FORMATS[out_format])
+        if streaming:
+            rels = _iter_parsed(parsed_path)
+        if out_format == "conll":
+            _write_conll(rels, toks, fn, out_path)
+        elif out_format == "pcc":
+            _write_pcc(rels, toks["tokens"], out_path, streaming=streaming)
+        else:
+            _write_jsonl(rels, out_path)
+
 
+def export_dir(parsed_dir, txt_dir, out_dirs, workers=1, cache_dir=None,
+               streaming=False):
+    """
+    Write transferred relations in several formats at once,
+    reading each document only once.
 
-def parse_berkeley(inp_dir, out_dir):
+    Parameters
+    ----------
+    parsed_dir : str
+        Directory containing the transferred relations.
+    txt_dir : str
+        Directory containing word-tokenized txt files.
+    out_dirs : dict
+        Directory to write to for each format, e.g.
+        {"conll": conll_dir, "pcc": pcc_dir}.
+        Formats are "conll" (CoNLL 2015 json), "pcc" (PCC xml)
+        and "jsonl" (the format of transfer_rels).
+    workers : int
+        Number of processes to use.
+    cache_dir : str or None
+        Directory to cache token tables in.
+    streaming : bool
+        Write the PCC xml incrementally instead of building it in memory.
+    """
+
+    for out_format, out_dir in out_dirs.items():
+        if out_format not in EXPORT_FORMATS:
+            raise ValueError("Unknown format: " + out_format)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+    export_fn = functools.partial(export_file, parsed_dir=parsed_dir,
+                                  txt_dir=txt_dir, out_dirs=out_dirs,
+                                  cache_dir=cache_dir, streaming=streaming)
+    process_files(export_fn, os.listdir(parsed_dir), workers)
+
+
+def _parse_file(parser, txt_path, out_path):
+    """
+    Parse all sentences of a file and write the trees as they come.
+    The trees are first written to a temporary file,
+    so that an interrupted run doesn't leave a partial parse behind.
+    """
+    with open(txt_path) as txt_file:
+        sents = [line.split() for line in txt_file]
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w") as out_file:
+        for tree in parser.parse_sents(sents):
+            tree.pprint(stream=out_file)
+    os.replace(tmp_path, out_path)
+
+
+# parser of a worker process, set by _init_parser
+_worker_parser = None
+
+
+def _init_parser(batch_size):
+    """
+    Load the parser once per worker process.
+    """
+    global _worker_parser
+    _worker_parser = benepar.Parser("benepar_de", batch_size=batch_size)
+
+
+def _parse_file_worker(paths):
+    """
+    Parse one file with the parser of the worker process.
+    """
+    txt_path, out_path = paths
+    _parse_file(_worker_parser, txt_path, out_path)
+
+
+# environment variables limiting the threads of TensorFlow and the math libraries
+THREAD_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS",
+               "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]
+
+
+def parse_berkeley(inp_dir, out_dir, workers=1, batch_size=64, threads=1):
     """
     Parse file using the berkely neural parser.
+    Files that were already parsed are skipped.
+
+    With several workers, each process loads its own parser.
+    The processes are started with spawn, so a script calling this
+    needs to do so under if __name__ == "__main__".
 
     Parameters
     ----------
@@ -261,31 +548,55 @@ def parse_berkeley(inp_dir, out_dir):
         Directory containing tokenized text files.
     out_dir : str
         Directory to save produced parses to.
+    workers : int
+        Number of processes to parse in.
+    batch_size : int
+        Number of sentences the parser processes at once.
+    threads : int
+        Number of threads each worker process may use,
+        if there are several workers.
     """
     
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    parser = benepar.Parser("benepar_de")
-
-    for i, fn in enumerate(os.listdir(inp_dir)):
-        if i == 10:
-            print(i)
-        if i % 5000 == 0:
-            print(i)
+    to_parse = []
+    for fn in sorted(os.listdir(inp_dir)):
         if fn[-4:] == "inds":
             continue
         txt_path = os.path.join(inp_dir,fn)
         out_path = os.path.join(out_dir, fn[:-4]+".ptree")
         if os.path.exists(out_path):
             continue
+        to_parse.append((txt_path, out_path))
+
+    if workers == 1:
+        parser = benepar.Parser("benepar_de", batch_size=batch_size)
+        for txt_path, out_path in tqdm(to_parse):
+            _parse_file(parser, txt_path, out_path)
+        return
+
+    # benepar 0.1.2 creates its own TensorFlow session,
+    # so the threads can only be limited through the environment,
+    # which the spawned processes read when they start
+    old_env = dict((var, os.environ.get(var)) for var in THREAD_VARS)
+    for var in THREAD_VARS:
+        os.environ[var] = str(threads)
+    try:
+        context = mp.get_context("spawn")
+        with context.Pool(workers, initializer=_init_parser,
+                          initargs=(batch_size,)) as pool:
+            parsed = pool.imap_unordered(_parse_file_worker, to_parse)
+            for _ in tqdm(parsed, total=len(to_parse)):
+                pass
+    finally:
+        for var, value in old_env.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
 
-        with open(out_path, "w") as out_file:
-            for line in open(txt_path):
-                tree = parser.parse(line.split())
-                tree.pprint(stream=out_file)
-            
-        
 def remove_incomplete(tiger_dir, txt_dir):
     """
     Remove files from the tiger xml directory,